@@ -5,4 +5,5 @@ def MARA_CONFIG_MODULES():
 
 def MARA_CLICK_COMMANDS():
     from . import config, cli
-    return [cli.download_data, cli.refresh_oauth2_token]
\ No newline at end of file
+    return [cli.download_data, cli.refresh_oauth2_token, cli.compact_data, cli.merge_shards,
+            cli.download_data_continuously]
\ No newline at end of file
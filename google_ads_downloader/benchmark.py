@@ -0,0 +1,128 @@
+"""
+End-to-end benchmarks of download_data_sets against the local API stand-in in fake_api
+
+    $ python -m google_ads_downloader.benchmark --output benchmark.json
+    $ python -m google_ads_downloader.benchmark --baseline benchmark.json
+"""
+import datetime
+import json
+import logging
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import click
+
+# The benchmark scenarios: the size of the fake account, the behaviour of the fake API and the config
+SCENARIOS = {
+    'sequential': {'client_customers': 10, 'ads_per_client_customer': 200, 'days': 7, 'latency': 0.05,
+                   'config': {'max_parallel_requests': 1}},
+    'parallel': {'client_customers': 10, 'ads_per_client_customer': 200, 'days': 7, 'latency': 0.05,
+                 'config': {'max_parallel_requests': 8}},
+    'multi-day-reports': {'client_customers': 10, 'ads_per_client_customer': 200, 'days': 7, 'latency': 0.05,
+                          'config': {'max_parallel_requests': 8, 'max_days_per_report': 7}},
+    'errors': {'client_customers': 10, 'ads_per_client_customer': 200, 'days': 7, 'latency': 0.05,
+               'error_rate': 0.05, 'disconnect_rate': 0.02,
+               'config': {'max_parallel_requests': 8, 'max_retries': 10}},
+    'large-accounts': {'client_customers': 4, 'ads_per_client_customer': 5000, 'days': 3, 'latency': 0.0,
+                       'config': {'max_parallel_requests': 4}},
+}
+
+
+def run_scenario(name: str, scenario: {}) -> {}:
+    """Runs download_data_sets for a scenario in a new data directory, should be called in a separate process
+    so that the configuration and the peak memory usage do not leak into other scenarios
+
+    Args:
+        name: The name of the scenario
+        scenario: The scenario (see SCENARIOS)
+
+    Returns:
+        A dictionary with the measurements
+    """
+    from google_ads_downloader import config, downloader, fake_api
+
+    logging.basicConfig(level=logging.WARNING)
+    statistics = fake_api.FakeApiStatistics()
+    api_client = fake_api.FakeAdWordsApiClient(number_of_client_customers=scenario['client_customers'],
+                                               ads_per_client_customer=scenario['ads_per_client_customer'],
+                                               latency=scenario.get('latency', 0.0),
+                                               error_rate=scenario.get('error_rate', 0.0),
+                                               disconnect_rate=scenario.get('disconnect_rate', 0.0),
+                                               statistics=statistics)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        first_date = datetime.date.today() - datetime.timedelta(days=scenario['days'])
+        scenario_config = {'data_dir': data_dir,
+                           'first_date': first_date.strftime('%Y-%m-%d'),
+                           'redownload_window': scenario['days'],
+                           'retry_backoff_factor': 0,
+                           **scenario.get('config', {})}
+        for key, value in scenario_config.items():
+            setattr(config, key, partial(lambda v: v, value))
+
+        started_at = time.monotonic()
+        downloader.download_data_sets(api_client)
+        duration = time.monotonic() - started_at
+
+        bytes_written = sum(path.stat().st_size for path in Path(data_dir).rglob('*')
+                            if path.is_file() and not any(part.startswith('.')
+                                                          for part in path.relative_to(data_dir).parts))
+
+    return {'scenario': name,
+            'seconds': round(duration, 3),
+            'requests': statistics.requests,
+            'failed_requests': statistics.failed_requests,
+            'rows': statistics.rows,
+            'rows_per_second': round(statistics.rows / duration, 1) if duration else None,
+            # kilobytes on Linux, bytes on macOS
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                                 / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1),
+            'bytes_written': bytes_written}
+
+
+@click.command()
+@click.option('--scenario', 'scenario_names', multiple=True, type=click.Choice(list(SCENARIOS.keys())),
+              help='The scenarios to run (can be given several times). Default: all')
+@click.option('--output', help='A file to write the results to as json')
+@click.option('--baseline', help='A json file with the results of a previous run to compare with')
+@click.option('--max-slowdown', default=0.2, show_default=True,
+              help='The fraction by which rows per second may drop compared to the baseline')
+def benchmark(scenario_names, output, baseline, max_slowdown):
+    """
+    Measures the throughput of download_data_sets against a local stand-in for the Google Ads API.
+    Exits with status 1 when a scenario is slower than the baseline by more than max-slowdown.
+    """
+    results = []
+    for name in scenario_names or SCENARIOS.keys():
+        # each scenario runs in a fresh process, so that peak memory usage is measured per scenario
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            result = executor.submit(run_scenario, name, SCENARIOS[name]).result()
+        results.append(result)
+        click.echo('{scenario:<20} {seconds:>8.2f}s {requests:>6} requests ({failed_requests} failed) '
+                   '{rows:>9} rows {rows_per_second:>10.1f} rows/s {peak_rss_mb:>8.1f} MB peak RSS '
+                   '{bytes_written:>11} bytes written'.format(**result))
+
+    if output:
+        with open(output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if baseline:
+        with open(baseline) as baseline_file:
+            baseline_results = {result['scenario']: result for result in json.load(baseline_file)}
+        regressions = [result['scenario'] for result in results
+                       if result['scenario'] in baseline_results
+                       and result['rows_per_second'] < (1 - max_slowdown)
+                       * baseline_results[result['scenario']]['rows_per_second']]
+        if regressions:
+            click.echo('slower than the baseline: {}'.format(', '.join(regressions)), err=True)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    benchmark()
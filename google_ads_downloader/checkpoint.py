@@ -0,0 +1,196 @@
+"""
+A journal of downloaded (client customer, day) performance units, so that interrupted downloads can be resumed
+"""
+import datetime
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+from google_ads_downloader import config, fingerprints
+
+
+class PerformanceCheckpoint:
+    """Keeps the downloaded performance rows of single client customers and days in a directory,
+    together with a journal of the completed units
+
+    A unit is reused when its day is older than the redownload window of its client customer (its data
+    does not change anymore) or when it was downloaded for the same last day after the last completed run
+    (i.e. by an interrupted run of the same day, see mark_run_completed).
+    """
+
+    def __init__(self, directory: Path, last_date: datetime, redownload_windows: {str: int} = None):
+        """
+        Args:
+            directory: The directory in which the units and the journals are stored
+            last_date: The last day that is downloaded by the current run
+            redownload_windows: (optional) The number of days for which the performance is redownloaded
+                by client customer id (as string), `config.redownload_window()` for missing client customers
+        """
+        self.directory = directory
+        self.last_date = last_date
+        self.redownload_windows = redownload_windows or {}
+        self.last_completed_run_at = _last_completed_run_at(directory)
+        self._journals = {}
+        # the client customer ids (as strings) of the units that were written by this checkpoint by day
+        self._written_units = {}
+        self._lock = threading.Lock()
+
+    def completed_client_customer_ids(self, single_date: datetime) -> {str}:
+        """Returns the ids (as strings) of the client customers for which a day does not need to be downloaded"""
+        return set(self._completed_units(single_date).keys())
+
+    def fingerprints(self, single_date: datetime) -> {str: str}:
+        """Returns the fingerprints of the completed units of a day by client customer id (as string)"""
+        return {client_customer_id: entry['fingerprint']
+                for client_customer_id, entry in self._completed_units(single_date).items()}
+
+    def downloaded_client_customer_ids(self, single_date: datetime) -> {str}:
+        """Returns the ids (as strings) of the client customers for which a day was downloaded by the current run,
+        without the units that were reused from an interrupted run"""
+        with self._lock:
+            return set(self._written_units.get(single_date.strftime('%Y-%m-%d'), set()))
+
+    def write_units(self, client_customer_id: int, dates: [datetime], serialized_rows: iter) -> {str: int}:
+        """Stores the performance of a client customer for a list of days and records the units in the journal
+
+        Args:
+            client_customer_id: The client customer id
+            dates: The days that were downloaded, also those without rows
+            serialized_rows: An iterator over (day ('%Y-%m-%d'), json encoded row) tuples
+
+        Returns:
+            The number of rows by day
+        """
+        days = [single_date.strftime('%Y-%m-%d') for single_date in dates]
+        files = {}
+        number_of_rows = {day: 0 for day in days}
+        digest_sums = {day: 0 for day in days}
+        try:
+            for day, serialized_row in serialized_rows:
+                if day not in files:
+                    unit_path = self._unit_path(day, client_customer_id)
+                    unit_path.parent.mkdir(exist_ok=True, parents=True)
+                    files[day] = gzip.open(str(unit_path) + '.tmp', 'wt', compresslevel=1)
+                files[day].write(serialized_row)
+                files[day].write('\n')
+                number_of_rows[day] = number_of_rows.get(day, 0) + 1
+                digest_sums[day] = digest_sums.get(day, 0) + fingerprints.row_digest(serialized_row)
+        finally:
+            for file in files.values():
+                file.close()
+
+        for day in days:
+            if day in files:
+                os.replace(str(self._unit_path(day, client_customer_id)) + '.tmp',
+                           str(self._unit_path(day, client_customer_id)))
+            self._append_to_journal(day, {'client_customer_id': str(client_customer_id),
+                                          'rows': number_of_rows[day],
+                                          'fingerprint': fingerprints.from_digest_sum(digest_sums[day]),
+                                          'last_date': self.last_date.strftime('%Y-%m-%d'),
+                                          'completed_at': datetime.datetime.now().isoformat()})
+        return number_of_rows
+
+    def serialized_rows(self, single_date: datetime, client_customer_ids: [int]) -> iter:
+        """Returns an iterator over the json encoded rows of the completed units of a day,
+        in the order of client_customer_ids"""
+        completed_units = self._completed_units(single_date)
+        for client_customer_id in client_customer_ids:
+            entry = completed_units.get(str(client_customer_id))
+            if entry and entry['rows']:
+                with gzip.open(str(self._unit_path(single_date.strftime('%Y-%m-%d'), client_customer_id)),
+                               'rt') as unit_file:
+                    for line in unit_file:
+                        yield line.rstrip('\n')
+
+    def remove(self, single_date: datetime):
+        """Removes all units of a day"""
+        day = single_date.strftime('%Y-%m-%d')
+        with self._lock:
+            self._journals.pop(day, None)
+        shutil.rmtree(str(Path(self.directory, day)), ignore_errors=True)
+
+    def remove_older_than(self, first_date: datetime):
+        """Removes all units of days before first_date"""
+        if self.directory.is_dir():
+            for day_directory in self.directory.iterdir():
+                try:
+                    single_date = datetime.datetime.strptime(day_directory.name, '%Y-%m-%d')
+                except ValueError:
+                    continue
+                if single_date.date() < first_date.date():
+                    self.remove(single_date)
+
+    def _completed_units(self, single_date: datetime) -> {str: {}}:
+        """Returns the journal entries of a day that do not need to be downloaded again
+        by client customer id (as string)"""
+        last_date = self.last_date.strftime('%Y-%m-%d')
+        age = (self.last_date - single_date).days
+        return {client_customer_id: entry for client_customer_id, entry in self._journal(single_date).items()
+                if 'fingerprint' in entry
+                and ((entry['last_date'] == last_date and self._after_last_completed_run(entry))
+                     or age > self.redownload_windows.get(client_customer_id, int(config.redownload_window())))}
+
+    def _after_last_completed_run(self, entry: {}) -> bool:
+        """Whether a unit was downloaded after the last run that completed, i.e. by an interrupted run"""
+        return (self.last_completed_run_at is None
+                or datetime.datetime.fromisoformat(entry['completed_at']) > self.last_completed_run_at)
+
+    def _journal(self, single_date: datetime) -> {str: {}}:
+        """Reads the journal of a day
+
+        Returns:
+            A dictionary mapping client customer ids (as strings) to their latest journal entry
+        """
+        day = single_date.strftime('%Y-%m-%d')
+        with self._lock:
+            if day not in self._journals:
+                journal = {}
+                journal_path = Path(self.directory, day, 'journal.jsonl')
+                if journal_path.is_file():
+                    with journal_path.open() as journal_file:
+                        for line in journal_file:
+                            try:
+                                entry = json.loads(line)
+                            except ValueError:
+                                # the last line of a journal of an interrupted run might be incomplete
+                                continue
+                            journal[entry['client_customer_id']] = entry
+                self._journals[day] = journal
+            return self._journals[day]
+
+    def _append_to_journal(self, day: str, entry: {}):
+        """Appends a completed unit to the journal of a day"""
+        journal = self._journal(datetime.datetime.strptime(day, '%Y-%m-%d'))
+        with self._lock:
+            journal_path = Path(self.directory, day, 'journal.jsonl')
+            journal_path.parent.mkdir(exist_ok=True, parents=True)
+            with journal_path.open('a') as journal_file:
+                journal_file.write(json.dumps(entry) + '\n')
+            journal[entry['client_customer_id']] = entry
+            self._written_units.setdefault(day, set()).add(entry['client_customer_id'])
+
+    def _unit_path(self, day: str, client_customer_id: int) -> Path:
+        """The path of the file with the rows of a client customer and a day"""
+        return Path(self.directory, day, '{}.jsonl.gz'.format(client_customer_id))
+
+
+def mark_run_completed(directory: Path):
+    """Records in a checkpoint directory that a run completed, so that the next runs of the same day
+    download the units of the redownload window again instead of reusing them"""
+    if directory.is_dir():
+        with tempfile.NamedTemporaryFile('w', dir=str(directory), delete=False) as tmp_file:
+            json.dump({'completed_at': datetime.datetime.now().isoformat()}, tmp_file)
+        os.replace(tmp_file.name, str(Path(directory, 'completed-run.json')))
+
+
+def _last_completed_run_at(directory: Path) -> datetime:
+    """When the last run that used a checkpoint directory completed, None when no run completed"""
+    path = Path(directory, 'completed-run.json')
+    if not path.is_file():
+        return None
+    with path.open() as completed_run_file:
+        return datetime.datetime.fromisoformat(json.load(completed_run_file)['completed_at'])
@@ -46,8 +46,26 @@ def refresh_oauth2_token(**kwargs):
 @config_option(config.first_date)
 @config_option(config.redownload_window)
 @config_option(config.output_file_version)
+@config_option(config.output_format)
+@config_option(config.output_compression)
+@config_option(config.output_compression_level)
 @config_option(config.max_retries)
 @config_option(config.retry_backoff_factor)
+@config_option(config.max_parallel_requests)
+@config_option(config.max_days_per_report)
+@config_option(config.max_rows_per_report)
+@config_option(config.client_customers_cache_ttl)
+@config_option(config.report_cache_max_size)
+@config_option(config.report_cache_ttl)
+@config_option(config.adaptive_redownload_window_probe_interval)
+@config_option(config.account_structure_snapshot_max_age)
+@config_option(config.requests_per_second)
+@config_option(config.daily_operation_budget)
+@config_option(config.shard_index)
+@config_option(config.shard_count)
+@config_option(config.metrics_prometheus_textfile)
+@click.option('--profile', is_flag=True, help=f'{config.profile.__doc__}')
+@click.option('--dry_run', is_flag=True, help=f'{config.dry_run.__doc__}')
 def download_data(**kwargs):
     """
     Downloads data.
@@ -56,3 +74,83 @@ def download_data(**kwargs):
     apply_options(kwargs)
     from google_ads_downloader import downloader
     downloader.download_data()
+
+
+@click.command()
+@config_option(config.client_customer_id)
+@config_option(config.developer_token)
+@config_option(config.oauth2_client_id)
+@config_option(config.oauth2_client_secret)
+@config_option(config.oauth2_refresh_token)
+@config_option(config.data_dir)
+@config_option(config.first_date)
+@config_option(config.redownload_window)
+@config_option(config.output_file_version)
+@config_option(config.output_format)
+@config_option(config.output_compression)
+@config_option(config.output_compression_level)
+@config_option(config.max_retries)
+@config_option(config.retry_backoff_factor)
+@config_option(config.max_parallel_requests)
+@config_option(config.max_days_per_report)
+@config_option(config.max_rows_per_report)
+@config_option(config.client_customers_cache_ttl)
+@config_option(config.report_cache_max_size)
+@config_option(config.report_cache_ttl)
+@config_option(config.adaptive_redownload_window_probe_interval)
+@config_option(config.account_structure_snapshot_max_age)
+@config_option(config.requests_per_second)
+@config_option(config.daily_operation_budget)
+@config_option(config.shard_index)
+@config_option(config.shard_count)
+@config_option(config.metrics_prometheus_textfile)
+@config_option(config.daemon_host)
+@config_option(config.daemon_port)
+@config_option(config.daemon_recent_days)
+@config_option(config.daemon_recent_interval)
+@config_option(config.daemon_window_interval)
+@config_option(config.daemon_backfill_days)
+def download_data_continuously(**kwargs):
+    """
+    Keeps running and downloads the last days, the redownload window and missing older days on a schedule.
+    Serves its health on /health, its progress on /progress and its metrics on /metrics.
+    When options are not specified, then the defaults from config.py are used.
+    """
+    apply_options(kwargs)
+    from google_ads_downloader import daemon
+    daemon.run_daemon()
+
+
+@click.command()
+@config_option(config.data_dir)
+@config_option(config.redownload_window)
+@config_option(config.output_file_version)
+@config_option(config.output_format)
+@config_option(config.output_compression)
+@config_option(config.output_compression_level)
+def compact_data(**kwargs):
+    """
+    Merges the daily performance files of months that are older than the redownload window into monthly files.
+    When options are not specified, then the defaults from config.py are used.
+    """
+    apply_options(kwargs)
+    from google_ads_downloader import downloader
+    downloader.compact_data()
+
+
+@click.command()
+@config_option(config.data_dir)
+@config_option(config.redownload_window)
+@config_option(config.output_file_version)
+@config_option(config.output_format)
+@config_option(config.output_compression)
+@config_option(config.output_compression_level)
+@config_option(config.shard_count)
+def merge_shards(**kwargs):
+    """
+    Assembles the performance files and the account structure from the partial files of all shards.
+    When options are not specified, then the defaults from config.py are used.
+    """
+    apply_options(kwargs)
+    from google_ads_downloader import downloader
+    downloader.merge_shards()
@@ -0,0 +1,290 @@
+"""
+Merges the daily performance files of months that do not change anymore into a single file per month
+"""
+import datetime
+import functools
+import gzip
+import json
+import logging
+import os
+import re
+import tempfile
+from pathlib import Path
+
+from google_ads_downloader import config, output_formats
+
+# Matches the relative paths of daily performance files, e.g. '2019/09/03/google-ads/ad-performance_v5.json.gz'
+_DAILY_FILE_PATTERN = re.compile(r'^(\d{4})/(\d{2})/(\d{2})/google-ads/(.+?)_([^_/]+?)\.(json|ndjson|parquet)(\.gz|\.zst)?$')
+
+
+def compact_performance_files(performance_report_names: [str]) -> [{}]:
+    """Merges the daily performance files of all months that are older than `config.redownload_window()`
+    into `<YYYY>/<MM>/google-ads/<report>_<version>.<extension>` files, together with an index
+    of the position of each day in the monthly file (see compacted_days)
+
+    The rows of a month are sorted by day and ad (or keyword) id. For json files, each day is a separately
+    compressed block of newline delimited json, for parquet files each day is a row group.
+    Months that were compacted before are merged again with daily files that were downloaded later.
+
+    Args:
+        performance_report_names: The names of the performance reports to compact, e.g. ['ad-performance']
+
+    Returns:
+        A list of the changed partitions (see downloader.write_changed_partitions_manifest)
+    """
+    yesterday = datetime.datetime.now() - datetime.timedelta(days=1)
+    first_mutable_date = (yesterday - datetime.timedelta(days=int(config.redownload_window()))).date()
+
+    changed_partitions = []
+    for performance_report_name in performance_report_names:
+        for (year, month), daily_files in sorted(_daily_files(performance_report_name).items()):
+            if _last_day_of_month(year, month) >= first_mutable_date:
+                continue
+            month_file = compact_month(performance_report_name, year, month, daily_files)
+            changed_partitions.append({'data_set': performance_report_name,
+                                       'partition': '{:04d}-{:02d}'.format(year, month),
+                                       'file': str(month_file)})
+    return changed_partitions
+
+
+def compact_month(performance_report_name: str, year: int, month: int, daily_files: {str: Path}) -> Path:
+    """Merges the daily files of a month (and an existing monthly file) into a new monthly file
+    and removes the daily files
+
+    Args:
+        performance_report_name: The name of the performance report, e.g. 'ad-performance'
+        year: The year of the month
+        month: The month
+        daily_files: The daily files of the month by day ('%Y-%m-%d')
+
+    Returns:
+        The path of the monthly file, relative to the data directory
+    """
+    relative_filepath = monthly_file_path(performance_report_name, year, month)
+    filepath = Path(config.data_dir(), relative_filepath)
+    filepath.parent.mkdir(exist_ok=True, parents=True)
+    logging.info('compacting {} days of google ads {} into {}'.format(
+        len(daily_files), performance_report_name, relative_filepath))
+
+    previous_index = _read_index_file(performance_report_name, year, month)
+    if previous_index and previous_index['file'].endswith('.parquet') != filepath.name.endswith('.parquet'):
+        raise ValueError('{} was compacted in a different output format than "{}"'.format(
+            previous_index['file'], config.output_format()))
+    tmp_filepath = str(filepath) + '.tmp'
+    try:
+        if config.output_format() == 'parquet':
+            index = _write_parquet_month(performance_report_name, year, month, daily_files, tmp_filepath)
+        else:
+            index = _write_json_lines_month(performance_report_name, year, month, daily_files, tmp_filepath)
+        os.replace(tmp_filepath, str(filepath))
+    finally:
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
+
+    # the index is written last, as it marks the days of the month as downloaded
+    index_path = Path(config.data_dir(), monthly_index_path(performance_report_name, year, month))
+    with tempfile.NamedTemporaryFile('w', dir=str(index_path.parent), delete=False) as tmp_index_file:
+        json.dump({'file': filepath.name, 'days': index}, tmp_index_file, indent=2, sort_keys=True)
+    os.replace(tmp_index_file.name, str(index_path))
+
+    if previous_index and previous_index['file'] != filepath.name:
+        # the month was compacted before with a different compression
+        Path(filepath.parent, previous_index['file']).unlink()
+    for daily_file in daily_files.values():
+        daily_file.unlink()
+        try:
+            daily_file.parent.rmdir()
+            daily_file.parent.parent.rmdir()
+        except OSError:
+            # other files in the same directory
+            pass
+    return relative_filepath
+
+
+def monthly_file_path(performance_report_name: str, year: int, month: int) -> Path:
+    """The path of the compacted performance file of a month, relative to the data directory"""
+    extension = ('.parquet' if config.output_format() == 'parquet'
+                 else '.ndjson' + output_formats.COMPRESSION_EXTENSIONS[config.output_compression()])
+    return Path('{:04d}/{:02d}/google-ads/{}_{}{}'.format(
+        year, month, performance_report_name, config.output_file_version(), extension))
+
+
+def monthly_index_path(performance_report_name: str, year: int, month: int) -> Path:
+    """The path of the index of a compacted month, relative to the data directory"""
+    return Path('{:04d}/{:02d}/google-ads/{}_{}.index.json'.format(
+        year, month, performance_report_name, config.output_file_version()))
+
+
+def is_compacted(performance_report_name: str, single_date: datetime) -> bool:
+    """Whether the performance of a day is contained in a compacted monthly file"""
+    return single_date.strftime('%Y-%m-%d') in compacted_days(performance_report_name,
+                                                              single_date.year, single_date.month)
+
+
+def compacted_days(performance_report_name: str, year: int, month: int) -> {str: {}}:
+    """Reads the index of a compacted month
+
+    Returns:
+        A dictionary mapping the days ('%Y-%m-%d') of the month to their number of 'rows' and
+        their 'offset' and 'length' in bytes (json) or their 'row_group' (parquet) in the monthly file
+    """
+    return _read_index_file(performance_report_name, year, month).get('days', {})
+
+
+def read_compacted_day(performance_report_name: str, single_date: datetime) -> [str]:
+    """Reads the json encoded rows of a day from a compacted monthly json file"""
+    index_path = Path(config.data_dir(), monthly_index_path(performance_report_name,
+                                                            single_date.year, single_date.month))
+    index = _read_index_file(performance_report_name, single_date.year, single_date.month)
+    index_entry = index['days'][single_date.strftime('%Y-%m-%d')]
+    filepath = index_path.with_name(index['file'])
+    with filepath.open('rb') as monthly_file:
+        monthly_file.seek(index_entry['offset'])
+        block = _decompress(monthly_file.read(index_entry['length']), filepath.name)
+    return block.decode().splitlines()
+
+
+def _read_index_file(performance_report_name: str, year: int, month: int) -> {}:
+    """Reads the index of a compacted month, an empty dictionary if the month is not compacted"""
+    index_path = Path(config.data_dir(), monthly_index_path(performance_report_name, year, month))
+    try:
+        modification_time = index_path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    return _read_index(str(index_path), modification_time)
+
+
+@functools.lru_cache(maxsize=64)
+def _read_index(index_path: str, modification_time: int) -> {}:
+    """Reads an index file, cached by path and modification time"""
+    with open(index_path) as index_file:
+        return json.load(index_file)
+
+
+def _write_json_lines_month(performance_report_name: str, year: int, month: int,
+                            daily_files: {str: Path}, file_path: str) -> {str: {}}:
+    """Writes the rows of a month as newline delimited json, each day as a separately compressed block
+
+    Returns:
+        The index of the month (see compacted_days)
+    """
+    days = set(compacted_days(performance_report_name, year, month).keys()) | set(daily_files.keys())
+    compression = config.output_compression()
+    compression_level = int(config.output_compression_level())
+
+    index = {}
+    offset = 0
+    with open(file_path, 'wb') as monthly_file:
+        for day in sorted(days):
+            if day in daily_files:
+                serialized_rows = _read_daily_json_file(daily_files[day])
+            else:
+                serialized_rows = read_compacted_day(performance_report_name,
+                                                     datetime.datetime.strptime(day, '%Y-%m-%d'))
+            serialized_rows.sort(key=lambda serialized_row: _sort_key(json.loads(serialized_row)))
+            block = _compress(''.join(serialized_row + '\n' for serialized_row in serialized_rows).encode(),
+                              compression, compression_level)
+            monthly_file.write(block)
+            index[day] = {'rows': len(serialized_rows), 'offset': offset, 'length': len(block)}
+            offset += len(block)
+    return index
+
+
+def _write_parquet_month(performance_report_name: str, year: int, month: int,
+                         daily_files: {str: Path}, file_path: str) -> {str: {}}:
+    """Writes the rows of a month to a parquet file with one row group per day
+
+    Returns:
+        The index of the month (see compacted_days)
+    """
+    import pyarrow.parquet
+
+    compacted = compacted_days(performance_report_name, year, month)
+    existing_file = None
+    if compacted:
+        existing_file = pyarrow.parquet.ParquetFile(str(Path(config.data_dir(), monthly_file_path(
+            performance_report_name, year, month))))
+
+    index = {}
+    writer = None
+    row_groups = 0
+    try:
+        for day in sorted(set(compacted.keys()) | set(daily_files.keys())):
+            if day in daily_files:
+                table = pyarrow.parquet.read_table(str(daily_files[day]))
+            elif compacted[day].get('row_group') is not None:
+                table = existing_file.read_row_group(compacted[day]['row_group'])
+            else:
+                table = None
+            if table is None or table.num_rows == 0:
+                index[day] = {'rows': 0, 'row_group': None}
+                continue
+            sort_columns = [column for column in ['Day', 'Ad ID', 'Keyword ID'] if column in table.column_names]
+            table = table.sort_by([(column, 'ascending') for column in sort_columns])
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(
+                    file_path, table.schema, compression=config.output_compression(),
+                    compression_level=int(config.output_compression_level()) or None)
+            writer.write_table(table.cast(writer.schema), row_group_size=table.num_rows)
+            index[day] = {'rows': table.num_rows, 'row_group': row_groups}
+            row_groups += 1
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        pyarrow.parquet.write_table(pyarrow.table({}), file_path)
+    return index
+
+
+def _read_daily_json_file(daily_file: Path) -> [str]:
+    """Reads the json encoded rows of a daily json or newline delimited json file"""
+    with output_formats.open_compressed(str(daily_file)) as file:
+        if '.ndjson' in daily_file.name:
+            return [line.rstrip('\n') for line in file if line.strip()]
+        return [json.dumps(row) for row in json.load(file)]
+
+
+def _sort_key(row: {}) -> tuple:
+    """Sorts rows by day and ad or keyword id"""
+    row_id = row.get('Ad ID') or row.get('Keyword ID') or ''
+    return row.get('Day', ''), int(row_id) if row_id.isdigit() else 0, row_id
+
+
+def _compress(data: bytes, compression: str, compression_level: int) -> bytes:
+    """Compresses a block of data as a single gzip member or zstd frame"""
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=compression_level or 3).compress(data)
+    return gzip.compress(data, compresslevel=compression_level or 9)
+
+
+def _decompress(block: bytes, file_name: str) -> bytes:
+    """Decompresses a single gzip member or zstd frame"""
+    if file_name.endswith('.zst'):
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(block)
+    return gzip.decompress(block)
+
+
+def _daily_files(performance_report_name: str) -> {(int, int): {str: Path}}:
+    """Finds the daily files of a performance report in the configured output format
+
+    Returns:
+        A dictionary mapping (year, month) to the daily files of the month by day ('%Y-%m-%d')
+    """
+    parquet = config.output_format() == 'parquet'
+    data_dir = Path(config.data_dir())
+    daily_files = {}
+    for daily_file in data_dir.glob('[0-9][0-9][0-9][0-9]/[0-9][0-9]/[0-9][0-9]/google-ads/{}_{}.*'.format(
+            performance_report_name, config.output_file_version())):
+        match = _DAILY_FILE_PATTERN.match(daily_file.relative_to(data_dir).as_posix())
+        if not match or match.group(4) != performance_report_name or (match.group(6) == 'parquet') != parquet:
+            continue
+        year, month, day = int(match.group(1)), int(match.group(2)), int(match.group(3))
+        daily_files.setdefault((year, month), {})['{:04d}-{:02d}-{:02d}'.format(year, month, day)] = daily_file
+    return daily_files
+
+
+def _last_day_of_month(year: int, month: int) -> datetime.date:
+    """The last day of a month"""
+    return datetime.date(year + month // 12, month % 12 + 1, 1) - datetime.timedelta(days=1)
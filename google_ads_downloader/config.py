@@ -54,16 +54,177 @@ def output_file_version() -> str:
     return 'v5'
 
 
+def output_format() -> str:
+    """The format of the performance files, 'json' (json arrays), 'ndjson' (one json object per line)
+    or 'parquet' (typed columns, requires pyarrow)"""
+    return 'json'
+
+
+def output_compression() -> str:
+    """The codec with which performance files are compressed, 'gzip' or 'zstd' (requires zstandard)"""
+    return 'gzip'
+
+
+def output_compression_level() -> int:
+    """The compression level of performance files (0 for the default level of the codec)"""
+    return 0
+
+
 def max_retries() -> int:
     """How often try retry at max in case of 500 errors"""
     return 5
 
 
 def retry_backoff_factor() -> int:
-    """How many seconds to wait between retries (is multiplied with retry count)"""
+    """How many seconds to wait before the first retry (is doubled with every retry and jittered)"""
     return 5
 
 
+def max_parallel_requests() -> int:
+    """How many client customers to download reports for in parallel (1 disables parallel downloads)"""
+    return 1
+
+
+def max_days_per_report() -> int:
+    """How many consecutive days to request at max in a single performance report (1 requests each day separately)"""
+    return 1
+
+
+def max_rows_per_report() -> int:
+    """How many rows a single performance report should have at max, fewer days are requested per report when exceeded"""
+    return 1000000
+
+
+def prescan_account_activity() -> bool:
+    """Whether to skip downloading performance reports for client customers without impressions on a day,
+    determined with a single account performance report per client customer"""
+    return False
+
+
+def cache_oauth2_access_token() -> bool:
+    """Whether to keep the OAuth2 access token in `<data_dir>/.state` until it expires, so that
+    runs and worker clients do not need to refresh it"""
+    return False
+
+
+def client_customers_cache_ttl() -> int:
+    """For how many seconds the client customers of the manager account are cached in `<data_dir>/.state`
+    (0 to always fetch them)"""
+    return 0
+
+
+def report_cache_max_size() -> int:
+    """How many megabytes of downloaded reports to keep in a cache in the data directory (0 disables the cache)"""
+    return 0
+
+
+def report_cache_ttl() -> int:
+    """How many seconds cached reports of days within the redownload window are valid (reports cached after their days left the window never expire)"""
+    return 3600
+
+
+def checkpoint_downloads() -> bool:
+    """Whether to keep the downloaded performance of each client customer and day on disk until the run
+    completed, so that interrupted runs can be resumed"""
+    return False
+
+
+def adaptive_redownload_window() -> bool:
+    """Whether to learn for each client customer how many days of performance data still change and to only
+    redownload those (at most `redownload_window` days)"""
+    return False
+
+
+def adaptive_redownload_window_probe_interval() -> int:
+    """Every how many days the whole redownload window is downloaded when the redownload window is adaptive"""
+    return 7
+
+
+def incremental_account_structure() -> bool:
+    """Whether to keep the account structure of each client customer in `<data_dir>/.account-structure` and
+    to only redownload client customers whose campaigns, ad groups, ads or keywords changed"""
+    return False
+
+
+def account_structure_snapshot_max_age() -> int:
+    """After how many days the account structure of a client customer is redownloaded even if no changes
+    were found"""
+    return 7
+
+
+def account_structure_changes() -> bool:
+    """Whether to write the ads and keywords that were added, changed or removed by a run to
+    `google-<type>-account-structure-changes_<version>.csv.gz` (requires `incremental_account_structure`)"""
+    return False
+
+
+def requests_per_second() -> float:
+    """How many requests to make to the Google Ads API per second at max (0 for no limit)"""
+    return 0
+
+
+def daily_operation_budget() -> int:
+    """How many requests to make to the Google Ads API per day at max (0 for no limit)"""
+    return 0
+
+
+def shard_index() -> int:
+    """The shard of the client customers to download, between 0 and shard_count - 1"""
+    return 0
+
+
+def shard_count() -> int:
+    """Into how many shards the client customers are partitioned (1 for no sharding), shards only write
+    partial files to `<data_dir>/.shards` which are assembled by merge_shards"""
+    return 1
+
+
+def metrics_prometheus_textfile() -> str:
+    """A file to which the metrics of a run are written in the Prometheus text format (empty to disable)"""
+    return ''
+
+
+def profile() -> bool:
+    """Whether to profile the run, writes sampled stacks (for flame graphs) and the largest allocations
+    to `<data_dir>/.profile`"""
+    return False
+
+
+def dry_run() -> bool:
+    """Whether to only plan the run and print an estimate of its requests, rows and time instead of downloading"""
+    return False
+
+
+def daemon_host() -> str:
+    """The host on which the daemon serves its health and progress"""
+    return '127.0.0.1'
+
+
+def daemon_port() -> int:
+    """The port on which the daemon serves its health and progress"""
+    return 8080
+
+
+def daemon_recent_days() -> int:
+    """How many of the last days the daemon downloads frequently"""
+    return 2
+
+
+def daemon_recent_interval() -> int:
+    """Every how many seconds the daemon downloads the last days"""
+    return 3600
+
+
+def daemon_window_interval() -> int:
+    """Every how many seconds the daemon downloads the whole redownload window and the account structure"""
+    return 86400
+
+
+def daemon_backfill_days() -> int:
+    """How many days before the redownload window the daemon backfills at a time when no other download is due"""
+    return 30
+
+
 def ignore_removed_campaigns() -> bool:
     """Whether to ignore campaigns with status 'REMOVED'"""
     return False
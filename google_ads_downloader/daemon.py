@@ -0,0 +1,254 @@
+"""
+A long running process that keeps a client for the Google Ads API and schedules downloads continuously,
+with an HTTP endpoint for health checks and progress
+"""
+import datetime
+import json
+import logging
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from google_ads_downloader import config, downloader, metrics, rate_limiter
+
+
+class Task:
+    """A download that is repeated every `interval` seconds"""
+
+    def __init__(self, name: str, interval: float, download: callable):
+        """
+        Args:
+            name: The name of the task, e.g. 'recent-days'
+            interval: How many seconds to wait between two runs
+            download: The function that runs the task, may return the number of seconds until the next run
+                to deviate from the interval
+        """
+        self.name = name
+        self.interval = interval
+        self.download = download
+        self.next_run_at = time.time()
+        self.runs = 0
+        self.failures = 0
+        self.last_started_at = None
+        self.last_finished_at = None
+        self.last_error = None
+
+    def status(self) -> {}:
+        return {'name': self.name,
+                'runs': self.runs,
+                'failures': self.failures,
+                'last_started_at': _isoformat(self.last_started_at),
+                'last_finished_at': _isoformat(self.last_finished_at),
+                'last_error': self.last_error,
+                'next_run_at': _isoformat(self.next_run_at)}
+
+
+class Daemon:
+    """Runs the tasks in the order of their priority whenever they are due:
+
+    1. 'recent-days': The last `config.daemon_recent_days()` days, every `config.daemon_recent_interval()` seconds
+    2. 'redownload-window': The whole redownload window and the account structure,
+       every `config.daemon_window_interval()` seconds
+    3. 'backfill': The missing days before the redownload window, `config.daemon_backfill_days()` days at a time
+       and only when no other task is due
+
+    When the daily operation budget is used up, all tasks are paused until the next day. The changed partitions
+    of all tasks are collected in the changed partitions manifest until a consumer moves it away.
+    """
+
+    def __init__(self, api_client: downloader.AdWordsApiClient):
+        """
+        Args:
+            api_client: An AdWordsApiClient (or fake_api.FakeAdWordsApiClient) that is kept for all downloads
+        """
+        self.api_client = api_client
+        self.tasks = [Task('recent-days', float(config.daemon_recent_interval()), self.download_recent_days),
+                      Task('redownload-window', float(config.daemon_window_interval()),
+                           self.download_redownload_window),
+                      Task('backfill', 0, self.backfill)]
+        self.started_at = time.time()
+        self.current_task = None
+        self.paused_until = None
+        self._backfill_last_date = None
+        self._window_downloads = 0
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    def run(self):
+        """Runs due tasks until stop is called"""
+        while not self._stopped.is_set():
+            task = self._next_task()
+            if task is None:
+                next_run_at = min([other_task.next_run_at for other_task in self.tasks]
+                                  + [self.paused_until or float('inf')])
+                self._stopped.wait(max(0.0, min(next_run_at - time.time(), 60)))
+                continue
+            self._run_task(task)
+
+    def stop(self):
+        """Stops the daemon after the current task"""
+        logging.info('stopping after the current task')
+        self._stopped.set()
+
+    def download_recent_days(self):
+        """Downloads the performance of the last days, which change the most"""
+        yesterday = datetime.datetime.now() - datetime.timedelta(days=1)
+        downloader.download_data_sets(
+            self.api_client,
+            first_date=yesterday - datetime.timedelta(days=int(config.daemon_recent_days()) - 1),
+            account_structure=False, accumulate_changed_partitions=True)
+
+    def download_redownload_window(self):
+        """Downloads the performance of the redownload window and the account structure"""
+        if self._window_downloads:
+            # accounts might have been added to or removed from the manager account
+            self.api_client.refresh_client_customers()
+        self._window_downloads += 1
+        downloader.download_data_sets(
+            self.api_client,
+            first_date=datetime.datetime.now() - datetime.timedelta(days=1 + int(config.redownload_window())),
+            accumulate_changed_partitions=True)
+
+    def backfill(self) -> float:
+        """Downloads the missing days of the next `config.daemon_backfill_days()` days before the redownload window,
+        going back to `config.first_date()`
+
+        Returns:
+            0 when there are more days to backfill, `config.daemon_window_interval()` when the backfill reached
+            the first date
+        """
+        if self._backfill_last_date is None:
+            self._backfill_last_date = (datetime.datetime.now()
+                                        - datetime.timedelta(days=2 + int(config.redownload_window())))
+        first_date = self._backfill_last_date - datetime.timedelta(days=int(config.daemon_backfill_days()) - 1)
+        downloader.download_data_sets(self.api_client, first_date=first_date, last_date=self._backfill_last_date,
+                                      account_structure=False, accumulate_changed_partitions=True)
+        self._backfill_last_date = first_date - datetime.timedelta(days=1)
+        if self._backfill_last_date < datetime.datetime.strptime(config.first_date(), '%Y-%m-%d'):
+            # starts again from the redownload window the next time
+            self._backfill_last_date = None
+            return float(config.daemon_window_interval())
+        return 0
+
+    def health(self) -> {}:
+        """Returns the health of the daemon, 'ok' unless the last run of a task failed"""
+        with self._lock:
+            failing_tasks = [task.name for task in self.tasks if task.last_error is not None]
+            return {'status': 'failing' if failing_tasks else 'ok',
+                    'failing_tasks': failing_tasks,
+                    'uptime_seconds': round(time.time() - self.started_at)}
+
+    def progress(self) -> {}:
+        """Returns the state of all tasks and the metrics of the process"""
+        with self._lock:
+            return {'started_at': _isoformat(self.started_at),
+                    'current_task': self.current_task.name if self.current_task else None,
+                    'paused_until': _isoformat(self.paused_until),
+                    'remaining_operations': rate_limiter.rate_limiter().remaining_operations(),
+                    'client_customers': len(self.api_client.client_customers),
+                    'tasks': [task.status() for task in self.tasks],
+                    'metrics': metrics.summary()}
+
+    def _next_task(self) -> Task:
+        """Returns the due task with the highest priority, None if no task is due"""
+        now = time.time()
+        if self.paused_until is not None:
+            if now < self.paused_until:
+                return None
+            self.paused_until = None
+        return next((task for task in self.tasks if task.next_run_at <= now), None)
+
+    def _run_task(self, task: Task):
+        """Runs a task and schedules its next run"""
+        logging.info('running {}'.format(task.name))
+        with self._lock:
+            self.current_task = task
+            task.last_started_at = time.time()
+        delay = None
+        error = None
+        try:
+            delay = task.download()
+        except Exception as e:
+            logging.exception('{} failed'.format(task.name))
+            error = repr(e)
+
+        with self._lock:
+            self.current_task = None
+            task.runs += 1
+            task.last_finished_at = time.time()
+            task.last_error = error
+            if error is not None:
+                task.failures += 1
+            task.next_run_at = time.time() + (task.interval if delay is None else delay)
+            if rate_limiter.rate_limiter().remaining_operations() == 0:
+                tomorrow = datetime.datetime.combine(datetime.date.today() + datetime.timedelta(days=1),
+                                                     datetime.time())
+                self.paused_until = tomorrow.timestamp()
+                logging.warning('the daily operation budget is used up, pausing until {}'.format(tomorrow))
+
+
+def serve_status(daemon: Daemon, host: str, port: int) -> ThreadingHTTPServer:
+    """Serves the health, progress and metrics of a daemon in a background thread:
+
+    - `/health`: The health (see Daemon.health), with status 503 when it is not 'ok'
+    - `/progress`: The state of all tasks (see Daemon.progress)
+    - `/metrics`: All metrics in the Prometheus text format
+
+    Args:
+        daemon: A Daemon
+        host: The host to listen on
+        port: The port to listen on, 0 for a random free port
+
+    Returns:
+        The server, call `shutdown()` to stop it
+    """
+    server = ThreadingHTTPServer((host, port), _StatusRequestHandler)
+    server.downloader_daemon = daemon
+    threading.Thread(target=server.serve_forever, name='status-server', daemon=True).start()
+    logging.info('serving health and progress on http://{}:{}/'.format(*server.server_address[:2]))
+    return server
+
+
+class _StatusRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        daemon = self.server.downloader_daemon
+        if self.path == '/health':
+            health = daemon.health()
+            self._respond(200 if health['status'] == 'ok' else 503, 'application/json', json.dumps(health))
+        elif self.path == '/progress':
+            self._respond(200, 'application/json', json.dumps(daemon.progress(), indent=2, default=str))
+        elif self.path == '/metrics':
+            self._respond(200, 'text/plain; version=0.0.4', metrics.prometheus_text())
+        else:
+            self._respond(404, 'text/plain', 'not found\n')
+
+    def log_message(self, format, *args):
+        logging.debug('status server: ' + format % args)
+
+    def _respond(self, status: int, content_type: str, body: str):
+        body = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def run_daemon(api_client: downloader.AdWordsApiClient = None):
+    """Creates an AdWordsApiClient (unless one is given) and runs a Daemon until SIGTERM or SIGINT"""
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    daemon = Daemon(api_client or downloader.AdWordsApiClient())
+    server = serve_status(daemon, config.daemon_host(), int(config.daemon_port()))
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signal_number, lambda *_: daemon.stop())
+    try:
+        daemon.run()
+    finally:
+        server.shutdown()
+
+
+def _isoformat(timestamp: float) -> str:
+    return datetime.datetime.fromtimestamp(timestamp).isoformat() if timestamp is not None else None
@@ -1,26 +1,48 @@
+import codecs
+import collections
 import datetime
 import errno
 import gzip
 import http
 import csv
 import logging
+import os
+import queue
+import random
 import re
 import shutil
 import sys
-import io
 import tempfile
 import json
+import threading
 import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
 from enum import Enum
+from functools import partial
 from pathlib import Path
 
-from google_ads_downloader import config
+from google_ads_downloader import (compaction, config, fingerprints, metrics, output_formats, partition_index,
+                                   planner, profiling, rate_limiter, report_cache, rows, sharding, startup_cache,
+                                   structure_snapshots)
+from google_ads_downloader.checkpoint import PerformanceCheckpoint, mark_run_completed
 from googleads import adwords, oauth2, errors
 
 from google_auth_oauthlib.flow import InstalledAppFlow
 from oauthlib.oauth2.rfc6749.errors import InvalidGrantError
 
 
+# How many bytes of a downloaded report are kept in memory before it is spooled to disk
+_REPORT_SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+# How many downloaded items (days or client customers) are kept ahead of writing them to files
+_MAX_PREFETCHED_ITEMS = 1
+
+# How many managed customers are requested per page from the ManagedCustomerService
+_MANAGED_CUSTOMER_PAGE_SIZE = 1000
+
+
 class PerformanceReportType(Enum):
     """ A Google performance report type
     https://developers.google.com/adwords/api/docs/appendix/reports/ad-performance-report
@@ -48,48 +70,107 @@ class AdWordsApiClient(adwords.AdWordsClient):
 
         self.client = super(AdWordsApiClient, self).__init__(
             developer_token=config.developer_token(),
-            oauth2_client=oauth2.GoogleRefreshTokenClient(
-                client_id=config.oauth2_client_id(),
-                client_secret=config.oauth2_client_secret(),
-                refresh_token=config.oauth2_refresh_token()),
+            oauth2_client=_create_oauth2_client(),
             client_customer_id=config.client_customer_id())
+        self.client_customers = startup_cache.load_client_customers()
+        if self.client_customers is None:
+            self.refresh_client_customers()
+
+    def refresh_client_customers(self):
+        """Fetches the client customers of the manager account again, e.g. in long running processes"""
         self.client_customers = self._fetch_client_customers()
+        startup_cache.save_client_customers(self.client_customers)
 
-    def _fetch_managed_customer_page(self):
+    def create_worker_client(self) -> adwords.AdWordsClient:
+        """Creates a separate client with its own OAuth2 session and client customer context,
+        so that reports can be downloaded from several threads at the same time
+
+        Returns:
+            An AdWordsClient that must only be used by a single thread
+        """
+        return adwords.AdWordsClient(developer_token=config.developer_token(),
+                                     oauth2_client=_create_oauth2_client(),
+                                     client_customer_id=config.client_customer_id())
+
+    def _fetch_managed_customer_page(self, start_index: int = 0):
         """Fetches the data from the ManagedCustomerService containing the customer information
         https://developers.google.com/adwords/api/docs/reference/v201609/ManagedCustomerService.ManagedCustomerPage
 
+        Args:
+            start_index: The index of the first managed customer of the page
+
         Returns: ManagedCustomerPage
 
         """
+        # each page uses its own service, so that pages can be fetched from several threads
         service = self.GetService(service_name='ManagedCustomerService')
-        return service.get({'fields': ['CustomerId', 'Name', 'CanManageClients', 'AccountLabels', 'CurrencyCode']})
+        rate_limiter.rate_limiter().acquire()
+        metrics.increment('api_requests', report_type='ManagedCustomerService')
+        with metrics.timer('api_request_seconds', report_type='ManagedCustomerService'):
+            return service.get({'fields': ['CustomerId', 'Name', 'CanManageClients', 'AccountLabels', 'CurrencyCode'],
+                                'ordering': [{'field': 'CustomerId', 'sortOrder': 'ASCENDING'}],
+                                'paging': {'startIndex': start_index, 'numberResults': _MANAGED_CUSTOMER_PAGE_SIZE}})
 
     def _fetch_client_customers(self):
         """Fetches the client customers, including their names and account labels, from
          the Google Ads API
 
+        The first page of managed customers tells how many there are, the remaining pages are fetched
+        with up to `config.max_parallel_requests()` requests at the same time.
+
         Returns:
             A dictionary of client_customers with
             {customer_id: {'Name': account_name, 'Labels': account_labels}}
 
         """
-        managed_customer_page = self._fetch_managed_customer_page()
+        managed_customer_pages = [self._fetch_managed_customer_page()]
+        start_indexes = range(_MANAGED_CUSTOMER_PAGE_SIZE, managed_customer_pages[0].totalNumEntries,
+                              _MANAGED_CUSTOMER_PAGE_SIZE)
+        if start_indexes:
+            with ThreadPoolExecutor(max_workers=max(1, int(config.max_parallel_requests()))) as executor:
+                managed_customer_pages += executor.map(self._fetch_managed_customer_page, start_indexes)
+
         client_customers = {}
-        for managed_customer in managed_customer_page.entries:
-            # Exclude manager customers
-            # https://support.google.com/adwords/answer/6139186?hl=en
-            if not managed_customer.canManageClients:
-                account_labels = []
-                if hasattr(managed_customer, 'accountLabels'):
-                    account_labels = [x.name for x in managed_customer.accountLabels]
-                client_customers[managed_customer.customerId] = {
-                    'Name': managed_customer.name,
-                    'Labels': account_labels,
-                    'Currency Code': managed_customer.currencyCode}
+        for managed_customer_page in managed_customer_pages:
+            for managed_customer in getattr(managed_customer_page, 'entries', None) or []:
+                # Exclude manager customers
+                # https://support.google.com/adwords/answer/6139186?hl=en
+                if not managed_customer.canManageClients:
+                    account_labels = []
+                    if hasattr(managed_customer, 'accountLabels'):
+                        account_labels = [x.name for x in managed_customer.accountLabels]
+                    client_customers[managed_customer.customerId] = {
+                        'Name': managed_customer.name,
+                        'Labels': account_labels,
+                        'Currency Code': managed_customer.currencyCode}
         return client_customers
 
 
+def _create_oauth2_client() -> oauth2.GoogleRefreshTokenClient:
+    """Creates an OAuth2 client from the configured credentials, with the cached access token
+    when `config.cache_oauth2_access_token()` is enabled"""
+    if config.cache_oauth2_access_token():
+        access_token, token_expiry = startup_cache.load_access_token()
+        return _CachingRefreshTokenClient(
+            client_id=config.oauth2_client_id(),
+            client_secret=config.oauth2_client_secret(),
+            refresh_token=config.oauth2_refresh_token(),
+            access_token=access_token,
+            token_expiry=token_expiry)
+    return oauth2.GoogleRefreshTokenClient(
+        client_id=config.oauth2_client_id(),
+        client_secret=config.oauth2_client_secret(),
+        refresh_token=config.oauth2_refresh_token())
+
+
+class _CachingRefreshTokenClient(oauth2.GoogleRefreshTokenClient):
+    """An OAuth2 client that caches refreshed access tokens (see startup_cache)"""
+
+    def Refresh(self):
+        super(_CachingRefreshTokenClient, self).Refresh()
+        startup_cache.save_access_token(self.creds.token, self.creds.expiry)
+
+
 def download_data():
     """Creates an AdWordsApiClient and downloads the data"""
     logging.basicConfig(level=logging.INFO,
@@ -97,17 +178,48 @@ def download_data():
 
     logging.info('Adwords API version: ' + str(config.api_version()))
 
-    api_client = AdWordsApiClient()
-    download_data_sets(api_client)
+    if config.dry_run():
+        # a dry run never downloads, also not when it is profiled
+        for line in estimate_download(AdWordsApiClient()):
+            logging.info(line)
+    elif config.profile():
+        with profiling.profile_run(ensure_data_directory(Path('.profile', '{:%Y-%m-%dT%H%M%S}'.format(
+                datetime.datetime.now())))):
+            download_data_sets(AdWordsApiClient())
+    else:
+        api_client = AdWordsApiClient()
+        download_data_sets(api_client)
+
+
+def download_data_sets(api_client: AdWordsApiClient, first_date: datetime = None, last_date: datetime = None,
+                       account_structure: bool = True, accumulate_changed_partitions: bool = False):
+    """Downloads the account structure and the AdWords ad performance and writes a manifest
+    of the files that changed (see write_changed_partitions_manifest)
 
+    The days in the redownload window of all data sets are downloaded first, then the account structure and
+    then the older days that are missing (see plan_performance_download). When `config.daily_operation_budget()`
+    is set and used up, the remaining downloads are left for the next run.
 
-def download_data_sets(api_client: AdWordsApiClient):
-    """Downloads the account structure and the AdWords ad performance
+    When `config.prescan_account_activity()` is enabled, the days with impressions are downloaded once for
+    all performance downloads of the run (see _prescan_account_activity).
+
+    When `config.shard_count()` is larger than 1, only the client customers of `config.shard_index()` are
+    downloaded and their data is written to partial files that are assembled by merge_shards.
 
     Args:
         api_client: AdWordsApiClient
+        first_date: (optional) The first day of performance to download, if none is specified
+            `config.first_date()` is used
+        last_date: (optional) The last day of performance to download, if none is specified yesterday is used
+        account_structure: Whether to download the account structure
+        accumulate_changed_partitions: Whether to add the changed partitions to the existing manifest
+            (see write_changed_partitions_manifest)
 
     """
+    started_at = datetime.datetime.now()
+    changed_partitions = []
+
+    _select_shard(api_client)
 
     base_predicates = [{
         'field': 'Impressions',
@@ -130,19 +242,27 @@ def download_data_sets(api_client: AdWordsApiClient):
                                                   'DISABLED']
                                        })
 
-    download_performance(api_client,
-                         PerformanceReportType.AD_PERFORMANCE_REPORT,
-                         fields=['Date', 'Id', 'AdGroupId', 'Device', 'AdNetworkType2',
-                                 'ActiveViewImpressions', 'AveragePosition',
-                                 'Clicks', 'Conversions', 'ConversionValue',
-                                 'Cost', 'Impressions'],
-                         predicates=ads_performance_predicates
-                         )
-
-    download_account_structure(api_client,
-                               AccountStructureType.AD_ACCOUNT_STRUCTURE,
-                               csv_header=['Ad Id', 'Ad', 'Ad Group Id', 'Ad Group', 'Campaign Id',
-                                           'Campaign', 'Customer Id', 'Customer Name', 'Attributes', 'Currency Code'])
+    performance_fields = ['Date', 'Id', 'AdGroupId', 'Device', 'AdNetworkType2',
+                          'ActiveViewImpressions', 'AveragePosition',
+                          'Clicks', 'Conversions', 'ConversionValue',
+                          'Cost', 'Impressions']
+
+    # campaign and ad group attributes by client customer id, shared by all account structure downloads
+    attribute_cache = {}
+
+    performance_report_types = [PerformanceReportType.AD_PERFORMANCE_REPORT]
+    performance_downloads = [partial(download_performance, api_client,
+                                     PerformanceReportType.AD_PERFORMANCE_REPORT,
+                                     fields=performance_fields,
+                                     predicates=ads_performance_predicates,
+                                     first_date=first_date,
+                                     last_date=last_date)]
+    account_structure_downloads = [partial(download_account_structure, api_client,
+                                           AccountStructureType.AD_ACCOUNT_STRUCTURE,
+                                           csv_header=['Ad Id', 'Ad', 'Ad Group Id', 'Ad Group',
+                                                       'Campaign Id', 'Campaign', 'Customer Id',
+                                                       'Customer Name', 'Attributes', 'Currency Code'],
+                                           attribute_cache=attribute_cache)]
 
     if config.download_keywords_performance_reports():
         keywords_performance_predicates = base_predicates.copy()
@@ -153,69 +273,713 @@ def download_data_sets(api_client: AdWordsApiClient):
                                                            'REMOVED']
                                                 })
 
-        download_performance(api_client,
-                             PerformanceReportType.KEYWORDS_PERFORMANCE_REPORT,
-                             fields=['Date', 'Id', 'AdGroupId', 'Device', 'AdNetworkType2',
-                                     'ActiveViewImpressions', 'AveragePosition',
-                                     'Clicks', 'Conversions', 'ConversionValue',
-                                     'Cost', 'Impressions'],
-                             predicates=keywords_performance_predicates
-                             )
-        download_account_structure(api_client,
-                                   AccountStructureType.KEYWORD_ACCOUNT_STRUCTURE,
-                                   csv_header=['Keyword Id', 'Keyword', 'Ad Group Id', 'Ad Group',
-                                               'Campaign Id', 'Campaign', 'Customer Id', 'Customer Name',
-                                               'Attributes', 'Currency Code'])
+        performance_report_types.append(PerformanceReportType.KEYWORDS_PERFORMANCE_REPORT)
+        performance_downloads.append(partial(download_performance, api_client,
+                                             PerformanceReportType.KEYWORDS_PERFORMANCE_REPORT,
+                                             fields=performance_fields,
+                                             predicates=keywords_performance_predicates,
+                                             first_date=first_date,
+                                             last_date=last_date))
+        account_structure_downloads.append(partial(download_account_structure, api_client,
+                                                   AccountStructureType.KEYWORD_ACCOUNT_STRUCTURE,
+                                                   csv_header=['Keyword Id', 'Keyword', 'Ad Group Id',
+                                                               'Ad Group', 'Campaign Id', 'Campaign',
+                                                               'Customer Id', 'Customer Name',
+                                                               'Attributes', 'Currency Code'],
+                                                   attribute_cache=attribute_cache))
+
+    if not account_structure:
+        account_structure_downloads = []
+
+    redownload_window_start = (datetime.datetime.now()
+                               - datetime.timedelta(days=1 + int(config.redownload_window())))
+
+    complete = True
+    try:
+        account_activity = None
+        if config.prescan_account_activity():
+            account_activity = _prescan_account_activity(api_client, performance_report_types, first_date, last_date)
+
+        downloads = ([partial(download, first_date=max(first_date or datetime.datetime.min, redownload_window_start),
+                              account_activity=account_activity)
+                      for download in performance_downloads]
+                     + account_structure_downloads
+                     + [partial(download, last_date=min(last_date or datetime.datetime.max,
+                                                        redownload_window_start - datetime.timedelta(days=1)),
+                                account_activity=account_activity)
+                        for download in performance_downloads])
+        for download in downloads:
+            changed_partitions += download()
+    except rate_limiter.DailyOperationBudgetExceededError as e:
+        complete = False
+        logging.warning('{}, the remaining data is downloaded by the next run'.format(e))
+
+    if complete:
+        _remove_performance_checkpoints()
+
+    if sharding.is_sharded():
+        # the partitions are only changed by merge_shards
+        sharding.write_shard_state(datetime.datetime.now() - datetime.timedelta(days=1), complete,
+                                   changed_partitions)
+    else:
+        write_changed_partitions_manifest(changed_partitions, started_at, accumulate_changed_partitions)
+    write_metrics(started_at)
+
+
+def estimate_download(api_client: AdWordsApiClient) -> [str]:
+    """Plans a run of download_data_sets without downloading or writing anything and estimates its cost from
+    the metrics of the previous run (see planner.estimate)
+
+    The estimate is an upper bound when `config.adaptive_redownload_window()` or
+    `config.prescan_account_activity()` skip client customers.
+
+    Args:
+        api_client: An AdWordsApiClient
+
+    Returns:
+        The lines of the estimate (see planner.format_estimates)
+    """
+    _select_shard(api_client)
+    client_customer_ids = list(api_client.client_customers.keys())
+
+    previous_metrics = {}
+    if _metrics_file_path().is_file():
+        with _metrics_file_path().open() as metrics_file:
+            previous_metrics = json.load(metrics_file)
+    else:
+        logging.warning('no metrics of a previous run in {}, rows and time are unknown'.format(_metrics_file_path()))
+
+    performance_report_types = [PerformanceReportType.AD_PERFORMANCE_REPORT]
+    if config.download_keywords_performance_reports():
+        performance_report_types.append(PerformanceReportType.KEYWORDS_PERFORMANCE_REPORT)
+
+    # the partition index is not saved, so that a dry run does not write to the data directory
+    estimates = {performance_report_type.name: planner.estimate(
+        plan_performance_download(performance_report_type,
+                                  partition_index.load(performance_report_type.value, read_only=True), _yesterday()),
+        client_customer_ids, previous_metrics)
+        for performance_report_type in performance_report_types}
+
+    # the campaign and ad group attributes and one report per account structure type for each client customer
+    other_requests = len(client_customer_ids) * (2 + len(performance_report_types))
+    if config.prescan_account_activity() and any(priority_estimate['work_units']
+                                                 for report_type_estimates in estimates.values()
+                                                 for priority_estimate in report_type_estimates.values()):
+        # one account performance report per client customer for all planned days (see _prescan_account_activity)
+        other_requests += len(client_customer_ids)
+    return planner.format_estimates(estimates, other_requests, rate_limiter.rate_limiter().remaining_operations())
+
+
+def _prescan_account_activity(api_client: AdWordsApiClient, performance_report_types: [PerformanceReportType],
+                              first_date: datetime = None, last_date: datetime = None) -> {int: {str}}:
+    """Downloads the days with impressions of all client customers once for the whole range of days that is
+    planned for the performance reports of a run (see get_account_activity)
+
+    Args:
+        api_client: An AdWordsApiClient
+        performance_report_types: The PerformanceReportType objects that are downloaded by the run
+        first_date: (optional) The first day to download, if none is specified `config.first_date()` is used
+        last_date: (optional) The last day to download, if none is specified yesterday is used
+
+    Returns:
+        A dictionary mapping client customer ids to the set of days ('%Y-%m-%d') with impressions,
+        None when there are no days to download
+    """
+    work_units = [work_unit for performance_report_type in performance_report_types
+                  for work_unit in plan_performance_download(
+                      performance_report_type, partition_index.load(performance_report_type.value), _yesterday(),
+                      first_date, last_date)]
+    if not work_units:
+        return None
+    with _report_worker_pool(api_client) as executor:
+        return get_account_activity(api_client, list(api_client.client_customers.keys()),
+                                    min(work_unit.first_date for work_unit in work_units),
+                                    max(work_unit.last_date for work_unit in work_units), executor)
+
+
+def _select_shard(api_client: AdWordsApiClient):
+    """Keeps only the client customers of the configured shard when the run is sharded"""
+    if sharding.is_sharded():
+        number_of_client_customers = len(api_client.client_customers)
+        api_client.client_customers = sharding.select_client_customers(api_client.client_customers)
+        logging.info('downloading shard {} of {} with {} of {} client customers'.format(
+            config.shard_index(), config.shard_count(), len(api_client.client_customers),
+            number_of_client_customers))
+
+
+def compact_data():
+    """Merges the daily performance files of months that do not change anymore into monthly files"""
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    started_at = datetime.datetime.now()
+    changed_partitions = compaction.compact_performance_files(
+        [performance_report_type.value for performance_report_type in PerformanceReportType])
+    _index_compacted_months(changed_partitions)
+    write_changed_partitions_manifest(changed_partitions, started_at)
+
+
+def _index_compacted_months(compacted_months: [{}]):
+    """Points the days of compacted months to their monthly file in the partition indexes
+
+    Args:
+        compacted_months: The 'data_set', 'partition' ('%Y-%m') and 'file' of each compacted month
+    """
+    for data_set in sorted({compacted_month['data_set'] for compacted_month in compacted_months}):
+        partitions = partition_index.load(data_set)
+        for compacted_month in compacted_months:
+            if compacted_month['data_set'] != data_set:
+                continue
+            filepath = Path(config.data_dir(), compacted_month['file'])
+            size, checksum = filepath.stat().st_size, partition_index.file_checksum(filepath)
+            year, month = map(int, compacted_month['partition'].split('-'))
+            for day in compaction.compacted_days(data_set, year, month):
+                # the data of the day was downloaded when its daily file was written
+                partitions.add(day, compacted_month['file'], size, checksum, partitions.downloaded_at(day))
+            partitions.save()
+
+
+def merge_shards():
+    """Assembles the performance files and the account structure files from the partial files of all
+    `config.shard_count()` shards (see sharding), writes a manifest of the changed files and removes the
+    partial files"""
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if not sharding.is_sharded():
+        raise ValueError('shard_count must be larger than 1 for merging shards')
+
+    started_at = datetime.datetime.now()
+    shard_count = int(config.shard_count())
+    shard_states = sharding.load_shard_states(shard_count)
+    downloaded_data_sets = {partition['data_set'] for shard_state in shard_states
+                            for partition in shard_state['partitions']}
+
+    changed_partitions = []
+    for performance_report_type in PerformanceReportType:
+        if performance_report_type.value in downloaded_data_sets:
+            changed_partitions += _merge_performance_shards(performance_report_type, shard_states)
+    for account_structure_type in AccountStructureType:
+        if '{}-account-structure'.format(account_structure_type.value) in downloaded_data_sets:
+            changed_partitions += _merge_account_structure_shards(account_structure_type, shard_count)
+    write_changed_partitions_manifest(changed_partitions, started_at)
+
+    for shard_index in range(shard_count):
+        shutil.rmtree(str(sharding.shard_directory(shard_index, shard_count)))
+
+
+def _merge_performance_shards(performance_report_type: PerformanceReportType, shard_states: [{}]) -> [{}]:
+    """Writes the performance files of the days that were downloaded by the shards
+
+    Args:
+        performance_report_type: A PerformanceReportType object
+        shard_states: The states of all shards (see sharding.load_shard_states)
+
+    Returns:
+        A list of the changed partitions (see write_changed_partitions_manifest)
+    """
+    checkpoints = [PerformanceCheckpoint(_shard_performance_directory(performance_report_type,
+                                                                      shard_state['shard_index'],
+                                                                      shard_state['shard_count']),
+                                         datetime.datetime.strptime(shard_state['last_date'], '%Y-%m-%d'))
+                   for shard_state in shard_states]
+    last_date = max(checkpoint.last_date for checkpoint in checkpoints)
+    days = sorted({partition['partition'] for shard_state in shard_states for partition in shard_state['partitions']
+                   if partition['data_set'] == performance_report_type.value}, reverse=True)
+
+    day_fingerprints = fingerprints.load(performance_report_type.value)
+    partitions = partition_index.load(performance_report_type.value)
+    changed_partitions = []
+    for day in days:
+        single_date = datetime.datetime.strptime(day, '%Y-%m-%d')
+        checkpoints_by_client_customer_id = {int(client_customer_id): checkpoint for checkpoint in checkpoints
+                                             for client_customer_id
+                                             in checkpoint.completed_client_customer_ids(single_date)}
+        # the order of the client customers in the manager account is not known to the shards
+        client_customer_ids = sorted(checkpoints_by_client_customer_id.keys())
+        client_customer_fingerprints = {
+            str(client_customer_id): checkpoints_by_client_customer_id[client_customer_id]
+            .fingerprints(single_date)[str(client_customer_id)]
+            for client_customer_id in client_customer_ids}
+        serialized_rows = (serialized_row for client_customer_id in client_customer_ids
+                           for serialized_row in checkpoints_by_client_customer_id[client_customer_id]
+                           .serialized_rows(single_date, [client_customer_id]))
+        changed_partitions += _write_performance_day(performance_report_type, single_date,
+                                                     (last_date - single_date).days, client_customer_fingerprints,
+                                                     serialized_rows, day_fingerprints, partitions)
+        fingerprints.save(performance_report_type.value, day_fingerprints)
+    return changed_partitions
+
+
+def _merge_account_structure_shards(account_structure_type: AccountStructureType, shard_count: int) -> [{}]:
+    """Writes the account structure file from the files of the single client customers of all shards
+
+    Args:
+        account_structure_type: The type of the account structure (ad or keyword)
+        shard_count: The number of shards
+
+    Returns:
+        A list with the changed partition (see write_changed_partitions_manifest), empty if the file did not change
+    """
+    partial_filepaths = {int(path.name.split('.')[0]): path for shard_index in range(shard_count)
+                         for path in _shard_account_structure_directory(account_structure_type, shard_index,
+                                                                        shard_count).glob('*.csv.gz')}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_filepath = Path(tmp_dir, _account_structure_file_path(account_structure_type).name)
+        with gzip.open(str(tmp_filepath), 'wt') as tmp_campaign_structure_file:
+            # the order of the client customers in the manager account is not known to the shards
+            for number, client_customer_id in enumerate(sorted(partial_filepaths.keys())):
+                with gzip.open(str(partial_filepaths[client_customer_id]), 'rt', newline='') as partial_file:
+                    header = partial_file.readline()
+                    if number == 0:
+                        tmp_campaign_structure_file.write(header)
+                    shutil.copyfileobj(partial_file, tmp_campaign_structure_file)
+        return _replace_account_structure_file(account_structure_type, tmp_filepath)
+
+
+def _shard_performance_directory(performance_report_type: PerformanceReportType,
+                                 shard_index: int = None, shard_count: int = None) -> Path:
+    """The directory with the performance units of a shard, by default of the configured shard"""
+    return Path(sharding.shard_directory(shard_index, shard_count), '{filename}_{version}'.format(
+        filename=performance_report_type.value, version=config.output_file_version()))
+
+
+def _shard_account_structure_directory(account_structure_type: AccountStructureType,
+                                       shard_index: int = None, shard_count: int = None) -> Path:
+    """The directory with the account structure files of the client customers of a shard,
+    by default of the configured shard"""
+    return Path(sharding.shard_directory(shard_index, shard_count), '{filename}-account-structure_{version}'.format(
+        filename=account_structure_type.value, version=config.output_file_version()))
+
+
+def write_changed_partitions_manifest(changed_partitions: [{}], started_at: datetime, accumulate: bool = False):
+    """Writes the list of files that were changed by a run to
+    `<data_dir>/google-ads-changed-partitions_<version>.json`, so that downstream
+    pipelines only need to reload those
+
+    Args:
+        changed_partitions: A list of dictionaries with the 'data_set', 'partition' (a day or None)
+            and 'file' (relative to the data directory) of each changed file
+        started_at: When the run started
+        accumulate: Whether to add the changed partitions to those of an existing manifest instead of
+            replacing it, until a consumer acknowledges the manifest by moving it away
+    """
+    filepath = ensure_data_directory(Path('google-ads-changed-partitions_{version}.json'.format(
+        version=config.output_file_version())))
+    if accumulate and filepath.is_file():
+        with filepath.open() as manifest_file:
+            previous_manifest = json.load(manifest_file)
+        started_at = min(started_at, datetime.datetime.fromisoformat(previous_manifest['started_at']))
+        changed_partitions = list({(partition['data_set'], partition['partition']): partition
+                                   for partition in previous_manifest['changed_partitions'] + changed_partitions}
+                                  .values())
+    with tempfile.NamedTemporaryFile('w', dir=str(filepath.parent), delete=False) as tmp_manifest_file:
+        json.dump({'started_at': started_at.isoformat(),
+                   'finished_at': datetime.datetime.now().isoformat(),
+                   'changed_partitions': changed_partitions},
+                  tmp_manifest_file, indent=2)
+    os.replace(tmp_manifest_file.name, str(filepath))
+
+
+def write_metrics(started_at: datetime):
+    """Writes the metrics of the run (see metrics.summary) to `<data_dir>/google-ads-metrics_<version>.json`
+    and to `config.metrics_prometheus_textfile()` if set
+
+    Args:
+        started_at: When the run started
+    """
+    metrics.write_summary(_metrics_file_path(), started_at=started_at.isoformat(),
+                          finished_at=datetime.datetime.now().isoformat())
+    if config.metrics_prometheus_textfile():
+        metrics.write_prometheus_textfile(Path(config.metrics_prometheus_textfile()))
+
+
+def _metrics_file_path() -> Path:
+    """The file to which the metrics of a run are written"""
+    return Path(config.data_dir(), 'google-ads-metrics_{version}{shard}.json'.format(
+        version=config.output_file_version(), shard=sharding.shard_suffix()))
 
 
 def download_performance(api_client: AdWordsApiClient,
                          performance_report_type: PerformanceReportType,
                          fields: [str],
-                         predicates: [{}]):
+                         predicates: [{}],
+                         first_date: datetime = None,
+                         last_date: datetime = None,
+                         account_activity: {int: {str}} = None) -> [{}]:
     """Download the Google Ads performance and saves them as zipped json files to disk
 
+    Files are only rewritten when the fingerprint of their content changed. The days are downloaded
+    in the order of their priority (see plan_performance_download).
+
+    When `config.max_days_per_report()` is larger than 1, consecutive days are requested
+    in a single report per client customer and the rows are split by their `Day` column.
+
+    When `config.checkpoint_downloads()` is enabled, the performance of each client customer and day is
+    kept in `<data_dir>/.checkpoints` until the file of the day is written (for days in the redownload window
+    until the run completed), so that an interrupted run continues with the client customers and days
+    that were not downloaded yet.
+
+    When `config.adaptive_redownload_window()` is enabled, the performance of each client customer and day
+    is kept in `<data_dir>/.checkpoints` for the whole redownload window and each client customer is only
+    redownloaded for as many days as its data was observed to change (see _adaptive_redownload_windows).
+
+    When the run is sharded (see sharding), the performance of each client customer and day is only written
+    to `<data_dir>/.shards` and the files of the days are written by merge_shards.
+
     Args:
         api_client: An AdWordsApiClient
         performance_report_type: A PerformanceReportType object
-        fields: A list of fields to be included in the report
+        fields: A list of fields to be included in the report, must contain 'Date'
         predicates: A list of filters for the report
+        first_date: (optional) The first day to download, if none is specified `config.first_date()` is used
+        last_date: (optional) The last day to download, if none is specified yesterday is used
+        account_activity: (optional) The days with impressions by client customer id (see get_account_activity),
+            if given client customers are skipped on days without impressions
+
+    Returns:
+        A list of the changed partitions (see write_changed_partitions_manifest), when the run is sharded
+        the downloaded partitions with their partial files instead
     """
-    client_customer_ids = api_client.client_customers.keys()
+    client_customer_ids = list(api_client.client_customers.keys())
+
+    yesterday = _yesterday()
+    redownload_window = int(config.redownload_window())
+    partitions = partition_index.load(performance_report_type.value)
+    dates_chunks = planner.date_chunks(plan_performance_download(performance_report_type, partitions, yesterday,
+                                                                 first_date, last_date))
+
+    # the learned windows depend on the previous files of the days, which are not known to shards
+    adaptive_redownload_window = config.adaptive_redownload_window() and not sharding.is_sharded()
+    redownload_windows_name = '{}-redownload-windows'.format(performance_report_type.value)
+    redownload_window_state = fingerprints.load(redownload_windows_name) if adaptive_redownload_window else {}
+    redownload_windows = (_adaptive_redownload_windows(redownload_window_state, client_customer_ids, yesterday)
+                          if adaptive_redownload_window else {})
+    # the ages (in days before yesterday) of the redownloaded days by client customer id, and of those that changed
+    compared_ages, changed_ages = {}, {}
+
+    # the number of days per report for each client customer, adapted to the size of their reports
+    days_per_report = {}
+    day_fingerprints = fingerprints.load(performance_report_type.value)
+    changed_partitions = []
+    with _performance_checkpoint(performance_report_type, yesterday, redownload_windows,
+                                 persistent=adaptive_redownload_window) as checkpoint, \
+            _report_worker_pool(api_client) as executor:
+
+        def downloaded_dates_chunks():
+            for dates_chunk in dates_chunks:
+                active_client_customer_ids = client_customer_ids
+                if account_activity is not None:
+                    days = {single_date.strftime('%Y-%m-%d') for single_date in dates_chunk}
+                    active_client_customer_ids = [client_customer_id for client_customer_id in client_customer_ids
+                                                  if account_activity[client_customer_id] & days]
+
+                with profiling.allocation_snapshot('download {} {} - {}'.format(
+                        performance_report_type.value, dates_chunk[-1].strftime('%Y-%m-%d'),
+                        dates_chunk[0].strftime('%Y-%m-%d'))):
+                    _download_performance_units(api_client, checkpoint, active_client_customer_ids, dates_chunk,
+                                                performance_report_type, fields, predicates, days_per_report,
+                                                executor)
+                yield dates_chunk
+
+        # the next days are downloaded while the files of the previous days are written
+        with closing(_prefetch(downloaded_dates_chunks())) as downloaded_chunks:
+            for dates_chunk in downloaded_chunks:
+                if sharding.is_sharded():
+                    changed_partitions += [{'data_set': performance_report_type.value,
+                                            'partition': single_date.strftime('%Y-%m-%d'),
+                                            'file': str(Path(checkpoint.directory, single_date.strftime('%Y-%m-%d'))
+                                                        .relative_to(config.data_dir()))}
+                                           for single_date in dates_chunk]
+                    continue
+
+                for single_date in dates_chunk:
+                    day = single_date.strftime('%Y-%m-%d')
+                    age = (yesterday - single_date).days
+
+                    client_customer_fingerprints = checkpoint.fingerprints(single_date)
+                    previous_client_customer_fingerprints = day_fingerprints.get(day, {}).get('client_customers', {})
+                    for client_customer_id in checkpoint.downloaded_client_customer_ids(single_date):
+                        if client_customer_id in previous_client_customer_fingerprints:
+                            compared_ages.setdefault(client_customer_id, set()).add(age)
+                            if (previous_client_customer_fingerprints[client_customer_id]
+                                    != client_customer_fingerprints[client_customer_id]):
+                                changed_ages.setdefault(client_customer_id, set()).add(age)
+
+                    changed_partitions += _write_performance_day(
+                        performance_report_type, single_date, age, client_customer_fingerprints,
+                        checkpoint.serialized_rows(single_date, client_customer_ids), day_fingerprints, partitions)
+                    if age > redownload_window:
+                        # older days are not planned again once their file is written, the days of the
+                        # redownload window are kept until the run completed (see _remove_performance_checkpoints)
+                        checkpoint.remove(single_date)
+                fingerprints.save(performance_report_type.value, day_fingerprints)
+
+        if adaptive_redownload_window:
+            checkpoint.remove_older_than(yesterday - datetime.timedelta(days=redownload_window))
+            _update_redownload_window_state(redownload_window_state, redownload_windows,
+                                            compared_ages, changed_ages, yesterday)
+            fingerprints.save(redownload_windows_name, redownload_window_state)
+
+    return changed_partitions
+
+
+def plan_performance_download(performance_report_type: PerformanceReportType,
+                              partitions: partition_index.PartitionIndex, yesterday: datetime,
+                              first_date: datetime = None, last_date: datetime = None) -> [planner.WorkUnit]:
+    """Plans which days of a performance report are downloaded: all days in the redownload window first
+    and then the older days for which there is no file yet
 
-    first_date = datetime.datetime.strptime(config.first_date(), '%Y-%m-%d')
-    last_date = datetime.datetime.now() - datetime.timedelta(days=1)
+    Args:
+        performance_report_type: A PerformanceReportType object
+        partitions: The partition index of the performance report (see partition_index.load)
+        yesterday: The last day of the run at midnight (see _yesterday), from which the ages of the days are counted
+        first_date: (optional) The first day to download, if none is specified `config.first_date()` is used
+        last_date: (optional) The last day to download, if none is specified yesterday is used
+
+    Returns:
+        A list of planner.WorkUnit tuples in the order in which they are downloaded
+    """
+    first_date = max(_start_of_day(first_date or datetime.datetime.min),
+                     datetime.datetime.strptime(config.first_date(), '%Y-%m-%d'))
+    last_date = min(_start_of_day(last_date or yesterday), yesterday)
+    redownload_window = int(config.redownload_window())
+
+    dates_by_priority = {priority: [] for priority in planner.PRIORITIES}
     current_date = last_date
     while current_date >= first_date:
-        relative_filepath = Path('{date:%Y/%m/%d}/google-ads/{filename}_{version}.json.gz'.format(
-            date=current_date,
-            filename=performance_report_type.value,
-            version=config.output_file_version()))
-        filepath = ensure_data_directory(relative_filepath)
-
-        if (not filepath.is_file()
-                or (last_date - current_date).days <= int(config.redownload_window())):
-            report_list = get_performance_for_single_day(api_client,
-                                                         client_customer_ids,
-                                                         current_date,
-                                                         performance_report_type,
-                                                         fields,
-                                                         predicates)
-
-            with tempfile.TemporaryDirectory() as tmp_dir:
-                tmp_filepath = Path(tmp_dir, relative_filepath)
-                tmp_filepath.parent.mkdir(exist_ok=True, parents=True)
-                with gzip.open(str(tmp_filepath), 'wt') as tmp_ad_performance_file:
-                    tmp_ad_performance_file.write(json.dumps(report_list))
-                shutil.move(str(tmp_filepath), str(filepath))
+        if (yesterday - current_date).days <= redownload_window:
+            dates_by_priority['redownload-window'].append(current_date)
+        elif not _performance_file_exists(performance_report_type, current_date, partitions):
+            dates_by_priority['missing'].append(current_date)
         current_date += datetime.timedelta(days=-1)
 
+    return planner.plan_work_units(performance_report_type.name, dates_by_priority)
+
+
+def _yesterday() -> datetime:
+    """Yesterday at midnight, so that the age of a day (in days before yesterday) is a whole number of days"""
+    return _start_of_day(datetime.datetime.now() - datetime.timedelta(days=1))
+
+
+def _start_of_day(value: datetime) -> datetime:
+    """Midnight of the day of a datetime"""
+    return datetime.datetime.combine(value.date(), datetime.time())
+
+
+def _adaptive_redownload_windows(redownload_window_state: {str: {}}, client_customer_ids: [int],
+                                 last_date: datetime) -> {str: int}:
+    """Determines for how many days the performance of each client customer is redownloaded
+
+    Every `config.adaptive_redownload_window_probe_interval()` days (and as long as nothing is known about
+    a client customer), the whole `config.redownload_window()` is redownloaded to observe how far back
+    the data of the client customer still changes. Otherwise its learned number of days is redownloaded.
+
+    Args:
+        redownload_window_state: The learned redownload windows by client customer id (as string),
+            see _update_redownload_window_state
+        client_customer_ids: A list of client ids
+        last_date: The last day that is downloaded by the current run
+
+    Returns:
+        A dictionary mapping client customer ids (as strings) to their redownload window, like
+        `config.redownload_window()` the age of the oldest day that is redownloaded
+    """
+    redownload_window = int(config.redownload_window())
+    probe_interval = int(config.adaptive_redownload_window_probe_interval())
+    redownload_windows = {}
+    for client_customer_id in map(str, client_customer_ids):
+        state = redownload_window_state.get(client_customer_id, {})
+        last_full_redownload = state.get('last_full_redownload')
+        if (last_full_redownload is None or 'redownload_days' not in state
+                or (last_date - datetime.datetime.strptime(last_full_redownload, '%Y-%m-%d')).days >= probe_interval):
+            redownload_windows[client_customer_id] = redownload_window
+        else:
+            redownload_windows[client_customer_id] = min(redownload_window, state['redownload_days'] - 1)
+    return redownload_windows
+
+
+def _update_redownload_window_state(redownload_window_state: {str: {}}, redownload_windows: {str: int},
+                                    compared_ages: {str: {int}}, changed_ages: {str: {int}}, last_date: datetime):
+    """Learns the redownload window of each client customer from the changes observed by the current run
+
+    The state stores the 'redownload_days' of a client customer: the number of days that are redownloaded,
+    i.e. the days with the ages 0 to redownload_days - 1. After redownloading the whole configured window,
+    they are set to the days up to the oldest day that changed and one more day, which is expected not to
+    change. When the oldest day of a reduced window changes nevertheless, the number of days is doubled and
+    the whole configured window is redownloaded by the next run.
+
+    Args:
+        redownload_window_state: The learned redownload windows by client customer id (as string),
+            is updated in place
+        redownload_windows: The redownload windows used by the current run by client customer id (as string),
+            see _adaptive_redownload_windows
+        compared_ages: The ages (in days before last_date) of redownloaded days that were compared with
+            a previous download, by client customer id (as string)
+        changed_ages: The ages of the redownloaded days that changed, by client customer id (as string)
+        last_date: The last day that is downloaded by the current run
+    """
+    redownload_window = int(config.redownload_window())
+    for client_customer_id in compared_ages.keys():
+        used_redownload_window = redownload_windows.get(client_customer_id, redownload_window)
+        oldest_changed_age = max(changed_ages.get(client_customer_id, set()), default=-1)
+        if used_redownload_window >= redownload_window:
+            redownload_window_state[client_customer_id] = {
+                'redownload_days': min(redownload_window + 1, max(2, oldest_changed_age + 2)),
+                'last_full_redownload': last_date.strftime('%Y-%m-%d')}
+        elif oldest_changed_age >= used_redownload_window:
+            redownload_window_state[client_customer_id] = {
+                'redownload_days': min(redownload_window + 1, 2 * (used_redownload_window + 1)),
+                'last_full_redownload': None}
+
+
+def _write_performance_day(performance_report_type: PerformanceReportType, single_date: datetime, age: int,
+                           client_customer_fingerprints: {str: str}, serialized_rows: iter,
+                           day_fingerprints: {str: {}}, partitions: partition_index.PartitionIndex) -> [{}]:
+    """Writes the performance file of a day when the fingerprint of its content changed
+
+    Args:
+        performance_report_type: A PerformanceReportType object
+        single_date: The day of the performance
+        age: The number of days between single_date and the last day of the run
+        client_customer_fingerprints: The fingerprints of the rows of the day by client customer id (as string)
+        serialized_rows: An iterator over the json encoded rows of the day, only consumed when the file is written
+        day_fingerprints: The fingerprints of the files by day, is updated in place
+        partitions: The partition index of the performance report, is updated and saved when the file is written
+
+    Returns:
+        A list with the changed partition (see write_changed_partitions_manifest), empty if the file did not change
+    """
+    day = single_date.strftime('%Y-%m-%d')
+    changed_partitions = []
+    day_fingerprint = fingerprints.combine(client_customer_fingerprints.values())
+    if (day_fingerprints.get(day, {}).get('fingerprint') != day_fingerprint
+            or not _performance_file_exists(performance_report_type, single_date, partitions)):
+        _write_performance_file(performance_report_type, single_date, serialized_rows, partitions)
+        changed_partitions.append({'data_set': performance_report_type.value,
+                                   'partition': day,
+                                   'file': str(_performance_file_path(performance_report_type, single_date))})
+    else:
+        logging.info('google ads {} for {} did not change'.format(performance_report_type.value, day))
+
+    day_fingerprints[day] = {'fingerprint': day_fingerprint}
+    if age <= int(config.redownload_window()):
+        # the fingerprints of single client customers are only needed for detecting changes
+        day_fingerprints[day]['client_customers'] = client_customer_fingerprints
+    return changed_partitions
+
+
+@contextmanager
+def _performance_checkpoint(performance_report_type: PerformanceReportType, last_date: datetime,
+                            redownload_windows: {str: int} = None, persistent: bool = False):
+    """Creates the checkpoint in which the downloaded performance units are kept until their day is written
+
+    Args:
+        performance_report_type: A PerformanceReportType object
+        last_date: The last day that is downloaded by the current run
+        redownload_windows: (optional) The redownload window by client customer id (as string)
+        persistent: Whether to keep the checkpoint in the data directory even if
+            `config.checkpoint_downloads()` is disabled
+
+    Returns:
+        A PerformanceCheckpoint in `<data_dir>/.shards` when the run is sharded, in `<data_dir>/.checkpoints`
+        when `config.checkpoint_downloads()` is enabled, otherwise in a temporary directory
+    """
+    if sharding.is_sharded():
+        yield PerformanceCheckpoint(_shard_performance_directory(performance_report_type), last_date)
+    elif persistent or config.checkpoint_downloads():
+        yield PerformanceCheckpoint(ensure_data_directory(_performance_checkpoint_directory(performance_report_type)),
+                                    last_date, redownload_windows)
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            yield PerformanceCheckpoint(Path(tmp_dir), last_date, redownload_windows)
+
+
+def _performance_checkpoint_directory(performance_report_type: PerformanceReportType) -> Path:
+    """The directory of the persistent checkpoint of a performance report, relative to the data directory"""
+    return Path('.checkpoints', '{filename}_{version}'.format(filename=performance_report_type.value,
+                                                               version=config.output_file_version()))
+
+
+def _remove_performance_checkpoints():
+    """Removes the downloaded units of the redownload window after a run completed
+
+    They are kept until then, so that an interrupted run that is restarted on the same day does not download
+    them again. The units of the adaptive redownload window are kept, as the days older than the window of
+    a client customer are taken from them by the next runs, but they are marked as completed so that the
+    next runs of the same day download the window again (see mark_run_completed).
+    """
+    if sharding.is_sharded():
+        return
+    if config.adaptive_redownload_window():
+        for performance_report_type in PerformanceReportType:
+            mark_run_completed(
+                Path(config.data_dir(), _performance_checkpoint_directory(performance_report_type)))
+        return
+    if not config.checkpoint_downloads():
+        return
+    for performance_report_type in PerformanceReportType:
+        shutil.rmtree(str(Path(config.data_dir(), _performance_checkpoint_directory(performance_report_type))),
+                      ignore_errors=True)
+
+
+def _performance_file_path(performance_report_type: PerformanceReportType, single_date: datetime) -> Path:
+    """Returns the path of the performance file of a day, relative to the data directory"""
+    return Path('{date:%Y/%m/%d}/google-ads/{filename}_{version}{extension}'.format(
+        date=single_date,
+        filename=performance_report_type.value,
+        version=config.output_file_version(),
+        extension=output_formats.file_extension()))
+
+
+def _performance_file_exists(performance_report_type: PerformanceReportType, single_date: datetime,
+                             partitions: partition_index.PartitionIndex) -> bool:
+    """Whether the performance of a day was already written according to the partition index, either to
+    its own file or to a compacted monthly file (see compaction.compact_performance_files)"""
+    return partitions.file(single_date.strftime('%Y-%m-%d')) in (
+        str(_performance_file_path(performance_report_type, single_date)),
+        str(compaction.monthly_file_path(performance_report_type.value, single_date.year, single_date.month)))
+
+
+def _write_performance_file(performance_report_type: PerformanceReportType, single_date: datetime,
+                            serialized_rows: iter, partitions: partition_index.PartitionIndex):
+    """Writes the performance of a single day in the configured output format without keeping
+    all rows in memory and records the file in the partition index
+
+    Args:
+        performance_report_type: A PerformanceReportType object
+        single_date: The day of the performance
+        serialized_rows: An iterator over the json encoded rows of that day
+        partitions: The partition index of the performance report, is updated and saved
+    """
+    day = single_date.strftime('%Y-%m-%d')
+    relative_filepath = _performance_file_path(performance_report_type, single_date)
+    # the directory of a file that is already in the index exists
+    filepath = (Path(config.data_dir(), relative_filepath) if partitions.file(day) == str(relative_filepath)
+                else ensure_data_directory(relative_filepath))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_filepath = Path(tmp_dir, relative_filepath)
+        tmp_filepath.parent.mkdir(exist_ok=True, parents=True)
+        with metrics.timer('stage_seconds', stage='compress', report_type=performance_report_type.name):
+            output_formats.write_performance_rows(serialized_rows, str(tmp_filepath))
+        size, checksum = tmp_filepath.stat().st_size, partition_index.file_checksum(tmp_filepath)
+        with metrics.timer('stage_seconds', stage='move', report_type=performance_report_type.name):
+            try:
+                shutil.move(str(tmp_filepath), str(filepath))
+            except FileNotFoundError:
+                # the directory was removed since the file was indexed
+                shutil.move(str(tmp_filepath), str(ensure_data_directory(relative_filepath)))
+    partitions.add(day, relative_filepath, size, checksum)
+    partitions.save()
+
 
 def get_performance_for_single_day(api_client: AdWordsApiClient,
                                    client_customer_ids: [int],
                                    single_date: datetime,
                                    report_type: PerformanceReportType,
                                    fields: [],
-                                   predicates: []) -> [{}]:
+                                   predicates: [],
+                                   executor: ThreadPoolExecutor = None) -> iter:
     """Downloads the performance for a list of clients for a given day
 
     Args:
@@ -223,89 +987,641 @@ def get_performance_for_single_day(api_client: AdWordsApiClient,
         client_customer_ids: A list of client ids
         single_date: A single date as a datetime object
         report_type: A PerformanceReportType object
-        fields: A list of fields to be included in the report
+        fields: A list of fields to be included in the report, must contain 'Date'
         predicates: A list of filters for the report
+        executor: (optional) A worker pool from _report_worker_pool, if none is specified
+            the reports are downloaded one after another
 
     Returns:
-        A list containing dictionaries with the performance from the report
+        An iterator over dictionaries with the performance from the report, in the order of client_customer_ids
     """
-    report_list = []
-    logging.info(
-        'download google ads {} for {}'.format(report_type.value, single_date.strftime('%Y-%m-%d')))
-    for client_customer_id in client_customer_ids:
-        api_client.SetClientCustomerId(client_customer_id)
-        report = _download_adwords_report(api_client,
-                                          current_date=single_date,
-                                          report_type=report_type.name,
-                                          fields=fields,
-                                          predicates=predicates,
-                                          )
-        report_list.extend(list(report))
-    return report_list
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        checkpoint = PerformanceCheckpoint(Path(tmp_dir), single_date)
+        _download_performance_units(api_client, checkpoint, client_customer_ids, [single_date],
+                                    report_type, fields, predicates, {}, executor)
+        for serialized_row in checkpoint.serialized_rows(single_date, client_customer_ids):
+            yield json.loads(serialized_row)
+
+
+def _download_performance_units(api_client: AdWordsApiClient,
+                                checkpoint: PerformanceCheckpoint,
+                                client_customer_ids: [int],
+                                dates: [datetime],
+                                report_type: PerformanceReportType,
+                                fields: [],
+                                predicates: [],
+                                days_per_report: {int: int},
+                                executor: ThreadPoolExecutor = None):
+    """Downloads the performance for a list of clients for consecutive days into a checkpoint, skipping
+    the client customers and days that are already in the checkpoint
+
+    Several days are requested in one report and split by their `Day` column. The number of days per report
+    starts at `config.max_days_per_report()` and is reduced for client customers whose reports would exceed
+    `config.max_rows_per_report()` rows.
+
+    Args:
+        api_client: An AdWordsApiClient
+        checkpoint: The PerformanceCheckpoint to store the performance of each client customer and day in
+        client_customer_ids: A list of client ids
+        dates: A list of consecutive days, ordered from newest to oldest
+        report_type: A PerformanceReportType object
+        fields: A list of fields to be included in the report, must contain 'Date'
+        predicates: A list of filters for the report
+        days_per_report: The number of days per report by client customer id, is updated with
+            the number of days that fit into the next report
+        executor: (optional) A worker pool from _report_worker_pool, if none is specified
+            the reports are downloaded one after another
+    """
+    if len(dates) == 1:
+        logging.info('download google ads {} for {}'.format(report_type.value, dates[0].strftime('%Y-%m-%d')))
+    else:
+        logging.info('download google ads {} for {} - {}'.format(report_type.value,
+                                                                 dates[-1].strftime('%Y-%m-%d'),
+                                                                 dates[0].strftime('%Y-%m-%d')))
+    max_days = int(config.max_days_per_report())
+    max_rows = int(config.max_rows_per_report())
+
+    completed_client_customer_ids = {single_date: checkpoint.completed_client_customer_ids(single_date)
+                                     for single_date in dates}
+    pending_client_customer_ids = [client_customer_id for client_customer_id in client_customer_ids
+                                   if any(str(client_customer_id) not in completed_client_customer_ids[single_date]
+                                          for single_date in dates)]
+
+    def download_units(client: adwords.AdWordsClient, client_customer_id: int):
+        pending_dates = [single_date for single_date in dates
+                         if str(client_customer_id) not in completed_client_customer_ids[single_date]]
+        while pending_dates:
+            chunk = planner.consecutive_date_chunks(pending_dates,
+                                                    days_per_report.get(client_customer_id, max_days))[0]
+            report = _download_adwords_report(client,
+                                              current_date=chunk[-1],
+                                              last_date=chunk[0],
+                                              report_type=report_type.name,
+                                              fields=fields,
+                                              predicates=predicates)
+            number_of_rows = checkpoint.write_units(client_customer_id, chunk,
+                                                    _serialize_rows(report, report_type, client_customer_id))
+            metrics.increment('performance_days', len(chunk), report_type=report_type.name,
+                              client_customer_id=client_customer_id)
+            metrics.increment('performance_rows', sum(number_of_rows.values()), report_type=report_type.name,
+                              client_customer_id=client_customer_id)
+
+            rows_per_day = sum(number_of_rows.values()) / len(chunk)
+            days_per_report[client_customer_id] = (max(1, min(max_days, int(max_rows / rows_per_day)))
+                                                   if rows_per_day else max_days)
+            pending_dates = pending_dates[len(chunk):]
+
+    for _ in _map_client_customers(api_client, download_units, pending_client_customer_ids, executor):
+        pass
+
+
+def _serialize_rows(report: iter, report_type: PerformanceReportType, client_customer_id: int) -> iter:
+    """Serializes the rows of a performance report as json and records the time spent in metrics
+
+    Returns:
+        An iterator over (day ('%Y-%m-%d'), json encoded row) tuples
+    """
+    seconds = 0.0
+    for row in report:
+        started_at = time.perf_counter()
+        serialized_row = row.to_json()
+        seconds += time.perf_counter() - started_at
+        yield row['Day'], serialized_row
+    metrics.observe('stage_seconds', seconds, stage='serialize', report_type=report_type.name,
+                    client_customer_id=client_customer_id)
+
+
+def get_account_activity(api_client: AdWordsApiClient,
+                         client_customer_ids: [int],
+                         first_date: datetime,
+                         last_date: datetime,
+                         executor: ThreadPoolExecutor = None) -> {int: {str}}:
+    """Downloads the days with impressions for a list of clients with one account performance
+    report per client, so that client customers without impressions on a day can be skipped
+    https://developers.google.com/adwords/api/docs/appendix/reports/account-performance-report
+
+    Args:
+        api_client: An AdWordsApiClient
+        client_customer_ids: A list of client ids
+        first_date: The first day of the range
+        last_date: The last day of the range
+        executor: (optional) A worker pool from _report_worker_pool
+
+    Returns:
+        A dictionary mapping client customer ids to the set of days ('%Y-%m-%d') with impressions
+    """
+    logging.info('get account activity for {} - {}'.format(first_date.strftime('%Y-%m-%d'),
+                                                           last_date.strftime('%Y-%m-%d')))
+
+    def download_activity(client: adwords.AdWordsClient, client_customer_id: int):
+        report = _download_adwords_report(client,
+                                          current_date=first_date,
+                                          last_date=last_date,
+                                          report_type=PerformanceReportType.ACCOUNT_PERFORMANCE_REPORT.name,
+                                          fields=['Date', 'Impressions'],
+                                          predicates=[{'field': 'Impressions',
+                                                       'operator': 'GREATER_THAN',
+                                                       'values': [0]}])
+        return {row['Day'] for row in report}
+
+    activity = _map_client_customers(api_client, download_activity, client_customer_ids, executor)
+    return dict(zip(client_customer_ids, activity))
+
+
+def _prefetch(iterable: iter, max_ahead: int = _MAX_PREFETCHED_ITEMS) -> iter:
+    """Iterates over an iterable in a background thread, so that producing the next items (e.g. downloading)
+    overlaps with consuming the current one (e.g. compressing and writing)
+
+    The producer blocks when max_ahead items are waiting for the consumer, which bounds memory usage.
+    Exceptions of the producer are raised in the consumer, and the producer stops when the consumer stops.
+
+    Args:
+        iterable: The iterable to produce the items
+        max_ahead: How many produced items can wait for the consumer at max
+
+    Returns:
+        An iterator over the items of iterable
+    """
+    items = queue.Queue(maxsize=max_ahead)
+    stopped = threading.Event()
+    end = object()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((end, None))
+        except BaseException as e:
+            put((end, e))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is end:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stopped.set()
+        producer.join()
+
+
+def _map_client_customers(api_client: AdWordsApiClient, function: callable, client_customer_ids: [int],
+                          executor: ThreadPoolExecutor = None):
+    """Calls a function for each client customer, in parallel when an executor is given
+
+    Args:
+        api_client: An AdWordsApiClient
+        function: A function that takes a client (set to the client customer id) and the client customer id
+        client_customer_ids: A list of client ids
+        executor: (optional) A worker pool from _report_worker_pool
+
+    Returns:
+        An iterator over the results of the function, in the order of client_customer_ids
+    """
+    if executor is not None:
+        def parallel_results():
+            # only a limited number of results is kept ahead of the consumer to bound memory usage
+            futures = collections.deque()
+            for client_customer_id in client_customer_ids:
+                futures.append(executor.submit(lambda client_customer_id=client_customer_id:
+                                               function(_worker_client(client_customer_id), client_customer_id)))
+                if len(futures) >= 2 * int(config.max_parallel_requests()):
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+
+        return parallel_results()
+
+    def results():
+        for client_customer_id in client_customer_ids:
+            api_client.SetClientCustomerId(client_customer_id)
+            yield function(api_client, client_customer_id)
+
+    return results()
+
+
+_worker_context = threading.local()
+
+# The worker clients of the worker pools that were shut down by api client, for the next worker pools
+_idle_worker_clients = weakref.WeakKeyDictionary()
+_idle_worker_clients_lock = threading.Lock()
+
+
+@contextmanager
+def _report_worker_pool(api_client: AdWordsApiClient):
+    """Creates a pool of `config.max_parallel_requests()` threads for downloading reports,
+    each of them with its own client (see AdWordsApiClient.create_worker_client)
+
+    The worker clients are kept when the pool is shut down and reused by the next pools of the same api client,
+    so that long running processes (see daemon) keep their OAuth2 sessions and connections.
+
+    Args:
+        api_client: The AdWordsApiClient from which the worker clients are created
+
+    Returns:
+        A ThreadPoolExecutor or None when parallel downloads are disabled
+    """
+    max_workers = int(config.max_parallel_requests())
+    if max_workers <= 1:
+        yield None
+        return
+
+    worker_clients = []
+
+    def initialize_worker():
+        with _idle_worker_clients_lock:
+            idle_worker_clients = _idle_worker_clients.setdefault(api_client, [])
+            worker_client = idle_worker_clients.pop() if idle_worker_clients else None
+        _worker_context.client = worker_client or api_client.create_worker_client()
+        with _idle_worker_clients_lock:
+            worker_clients.append(_worker_context.client)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers, initializer=initialize_worker,
+                                thread_name_prefix='google-ads-report') as executor:
+            yield executor
+    finally:
+        with _idle_worker_clients_lock:
+            _idle_worker_clients.setdefault(api_client, []).extend(worker_clients)
+
+
+def _worker_client(client_customer_id: int) -> adwords.AdWordsClient:
+    """Returns the client of the current worker thread, set to the given client customer id"""
+    _worker_context.client.SetClientCustomerId(client_customer_id)
+    return _worker_context.client
 
 
 def download_account_structure(api_client: AdWordsApiClient,
                                account_structure_type: AccountStructureType,
-                               csv_header: [str]
-                               ):
+                               csv_header: [str],
+                               attribute_cache: {} = None
+                               ) -> [{}]:
     """Downloads the Google Ads account structure as saves it as a zipped csv file.
+    The file is only replaced when its content changed.
+
+    When the run is sharded (see sharding), the account structure of each client customer is written
+    to its own file in `<data_dir>/.shards` instead, which are assembled by merge_shards.
+
+    When `config.incremental_account_structure()` is enabled, only the client customers that changed since
+    the previous run are downloaded (see _download_account_structure_incrementally).
 
     Args:
         api_client: An AdWordsApiClient
         account_structure_type: The type of the account structure file (ad or keyword)
         csv_header: The list of columns to be included in the downloaded CSV file
+        attribute_cache: (optional) A dictionary in which the campaign and ad group attributes are kept
+            by client customer id, pass the same dictionary to reuse them across account structure types
 
+    Returns:
+        A list with the changed partition (see write_changed_partitions_manifest), empty if the file did not change
     """
-    filename = Path('google-{account_structure_type}-account-structure_{version}.csv.gz'.format(
+    if sharding.is_sharded():
+        return _download_account_structure_shard(api_client, account_structure_type, csv_header, attribute_cache)
+    if config.incremental_account_structure():
+        return _download_account_structure_incrementally(api_client, account_structure_type, csv_header,
+                                                         attribute_cache)
+
+    filename = _account_structure_file_path(account_structure_type)
+
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            profiling.allocation_snapshot('download {} account structure'.format(account_structure_type.value)):
+        tmp_filepath = Path(tmp_dir, filename)
+        with gzip.open(str(tmp_filepath), 'wt') as tmp_campaign_structure_file:
+            writer = csv.writer(tmp_campaign_structure_file, delimiter="\t")
+            writer.writerow(csv_header)
+            # the data of the next client customer is downloaded while the previous one is written
+            with closing(_prefetch(_download_account_data(api_client, account_structure_type,
+                                                          attribute_cache))) as downloaded_account_data:
+                for client_customer_id, campaign_attributes, ad_group_attributes, account_data \
+                        in downloaded_account_data:
+                    with metrics.timer('stage_seconds', stage='serialize',
+                                       report_type=account_structure_type.name,
+                                       client_customer_id=client_customer_id):
+                        _write_account_structure_rows(writer, account_structure_type, api_client.client_customers,
+                                                      client_customer_id, campaign_attributes,
+                                                      ad_group_attributes, account_data)
+
+        return _replace_account_structure_file(account_structure_type, tmp_filepath)
+
+
+def _account_structure_file_path(account_structure_type: AccountStructureType) -> Path:
+    """Returns the path of the account structure file, relative to the data directory"""
+    return Path('google-{account_structure_type}-account-structure_{version}.csv.gz'.format(
         account_structure_type=account_structure_type.value,
         version=config.output_file_version()))
+
+
+def _replace_account_structure_file(account_structure_type: AccountStructureType, tmp_filepath: Path) -> [{}]:
+    """Moves a new account structure file to the data directory when its content changed
+
+    Args:
+        account_structure_type: The type of the account structure (ad or keyword)
+        tmp_filepath: A temporary zipped csv file with the account structure
+
+    Returns:
+        A list with the changed partition (see write_changed_partitions_manifest), empty if the file did not change
+    """
+    filename = _account_structure_file_path(account_structure_type)
     filepath = ensure_data_directory(filename)
+    data_set = '{}-account-structure'.format(account_structure_type.value)
+    structure_fingerprints = fingerprints.load(data_set)
+    with gzip.open(str(tmp_filepath), 'rt') as tmp_campaign_structure_file:
+        structure_fingerprint = fingerprints.fingerprint(tmp_campaign_structure_file)
+    if (structure_fingerprints.get(str(filename), {}).get('fingerprint') == structure_fingerprint
+            and filepath.is_file()):
+        logging.info('google ads {} account structure did not change'.format(account_structure_type.value))
+        return []
+
+    with metrics.timer('stage_seconds', stage='move', report_type=account_structure_type.name):
+        shutil.move(str(tmp_filepath), str(filepath))
+    structure_fingerprints[str(filename)] = {'fingerprint': structure_fingerprint}
+    fingerprints.save(data_set, structure_fingerprints)
+    return [{'data_set': data_set, 'partition': None, 'file': str(filename)}]
+
+
+def _download_account_structure_incrementally(api_client: AdWordsApiClient,
+                                              account_structure_type: AccountStructureType,
+                                              csv_header: [str], attribute_cache: {} = None) -> [{}]:
+    """Keeps the account structure of each client customer in a snapshot in `<data_dir>/.account-structure`,
+    only redownloads the client customers that changed (see _download_changed_account_data) and assembles
+    the account structure file from the snapshots
+
+    When `config.account_structure_changes()` is enabled, the ads or keywords that were added, changed or
+    removed are written to a separate file (see _write_account_structure_changes).
+
+    Returns:
+        A list of the changed partitions (see write_changed_partitions_manifest)
+    """
+    snapshots = structure_snapshots.AccountStructureSnapshots(
+        Path(config.data_dir(), '.account-structure', '{}_{}'.format(account_structure_type.value,
+                                                                     config.output_file_version())),
+        '{}-account-structure-snapshots'.format(account_structure_type.value),
+        track_changes=config.account_structure_changes())
+
+    with profiling.allocation_snapshot('download {} account structure'.format(account_structure_type.value)), \
+            closing(_prefetch(_download_changed_account_data(api_client, account_structure_type, snapshots,
+                                                             attribute_cache))) as downloaded_account_data:
+        for (client_customer_id, attributes_fingerprint, probed_at, campaign_attributes, ad_group_attributes,
+             account_data) in downloaded_account_data:
+            if account_data is None:
+                continue
+            with metrics.timer('stage_seconds', stage='serialize', report_type=account_structure_type.name,
+                               client_customer_id=client_customer_id), \
+                    snapshots.replace(client_customer_id, attributes_fingerprint, probed_at) as writer:
+                _write_account_structure_rows(writer, account_structure_type, api_client.client_customers,
+                                              client_customer_id, campaign_attributes, ad_group_attributes,
+                                              account_data)
+    snapshots.remove_other_than(api_client.client_customers.keys())
 
     with tempfile.TemporaryDirectory() as tmp_dir:
-        tmp_filepath = Path(tmp_dir, filename)
+        tmp_filepath = Path(tmp_dir, _account_structure_file_path(account_structure_type).name)
         with gzip.open(str(tmp_filepath), 'wt') as tmp_campaign_structure_file:
-            writer = csv.writer(tmp_campaign_structure_file, delimiter="\t")
-            writer.writerow(csv_header)
-            for client_customer_id, client_customer in api_client.client_customers.items():
-                labels = json.dumps(client_customer['Labels'])
-                client_customer_attributes = parse_labels(labels)
-                client_customer_name = client_customer['Name']
-
-                campaign_attributes = get_campaign_attributes(api_client, client_customer_id)
-                ad_group_attributes = get_ad_group_attributes(api_client, client_customer_id)
-
-                if account_structure_type == AccountStructureType.AD_ACCOUNT_STRUCTURE:
-                    account_data = get_ad_data(api_client, client_customer_id)
-                    main_key_prefix = 'Ad'
-                else:
-                    account_data = get_keyword_data(api_client, client_customer_id)
-                    main_key_prefix = 'Keyword'
-
-                for account_data_dict in account_data:
-                    ad_id = account_data_dict[f'{main_key_prefix} ID']
-                    campaign_id = account_data_dict['Campaign ID']
-                    ad_group_id = account_data_dict['Ad group ID']
-                    currency_code = client_customer['Currency Code']
-                    attributes = {**client_customer_attributes,
-                                  **campaign_attributes.get(campaign_id, {}),
-                                  **ad_group_attributes.get(ad_group_id, {}),
-                                  **account_data_dict['attributes']}
-
-                    ad = [str(ad_id),
-                          account_data_dict[f'{main_key_prefix}'],
-                          str(ad_group_id),
-                          account_data_dict['Ad group'],
-                          str(campaign_id),
-                          account_data_dict['Campaign'],
-                          str(client_customer_id),
-                          client_customer_name,
-                          json.dumps(attributes),
-                          currency_code
-                          ]
-
-                    writer.writerow(ad)
+            csv.writer(tmp_campaign_structure_file, delimiter="\t").writerow(csv_header)
+            for client_customer_id in api_client.client_customers.keys():
+                snapshots.copy_to(client_customer_id, tmp_campaign_structure_file)
+        changed_partitions = _replace_account_structure_file(account_structure_type, tmp_filepath)
+
+    snapshots.save()
+    if config.account_structure_changes():
+        changed_partitions += _write_account_structure_changes(account_structure_type, csv_header,
+                                                               snapshots.changes)
+    return changed_partitions
+
+
+def _download_changed_account_data(api_client: AdWordsApiClient, account_structure_type: AccountStructureType,
+                                   snapshots: structure_snapshots.AccountStructureSnapshots,
+                                   attribute_cache: {} = None) -> iter:
+    """Downloads the ads or keywords of the client customers whose account structure changed since their snapshot
+
+    A snapshot is reused when the attributes of the client customer, its campaigns and its ad groups are the same,
+    it is not older than `config.account_structure_snapshot_max_age()` days and the CustomerSyncService reports
+    no changes since the previous probe (see get_account_changes).
+
+    Args:
+        api_client: An AdWordsApiClient
+        account_structure_type: The type of the account structure (ad or keyword)
+        snapshots: The snapshots of the account structure type
+        attribute_cache: (optional) A dictionary in which the campaign and ad group attributes are kept
+            by client customer id
+
+    Returns:
+        An iterator over (client customer id, attributes fingerprint, probe time, campaign attributes,
+        ad group attributes, account data) tuples, the account data is None when the snapshot can be reused
+    """
+    if attribute_cache is None:
+        attribute_cache = {}
+    for client_customer_id in api_client.client_customers.keys():
+        campaign_attributes, ad_group_attributes = _client_customer_attributes(api_client, client_customer_id,
+                                                                               attribute_cache)
+        attributes_fingerprint = fingerprints.fingerprint(
+            [json.dumps(api_client.client_customers[client_customer_id], sort_keys=True),
+             json.dumps(campaign_attributes, sort_keys=True),
+             json.dumps(ad_group_attributes, sort_keys=True)])
+        probed_at = datetime.datetime.utcnow()
+        if (snapshots.is_current(client_customer_id, attributes_fingerprint, probed_at)
+                and not get_account_changes(api_client, client_customer_id, list(map(int, campaign_attributes.keys())),
+                                            snapshots.probed_at(client_customer_id), probed_at)):
+            logging.info('google ads {} account structure of account {} did not change'.format(
+                account_structure_type.value, client_customer_id))
+            snapshots.record_probe(client_customer_id, probed_at)
+            yield client_customer_id, attributes_fingerprint, probed_at, campaign_attributes, ad_group_attributes, None
+        else:
+            yield (client_customer_id, attributes_fingerprint, probed_at, campaign_attributes, ad_group_attributes,
+                   _get_account_data(api_client, account_structure_type, client_customer_id))
+
+
+def _write_account_structure_changes(account_structure_type: AccountStructureType, csv_header: [str],
+                                     changes: [(str, [str])]) -> [{}]:
+    """Writes the ads or keywords that were added, changed or removed by the current run to
+    `google-<type>-account-structure-changes_<version>.csv.gz`, with the kind of change in the first column
 
+    Without changes, the file of the last run that found changes is kept.
+
+    Returns:
+        A list with the partition of the file (see write_changed_partitions_manifest), empty without changes
+    """
+    if not changes:
+        logging.info('no changes in the google ads {} account structure'.format(account_structure_type.value))
+        return []
+    filename = Path('google-{account_structure_type}-account-structure-changes_{version}.csv.gz'.format(
+        account_structure_type=account_structure_type.value,
+        version=config.output_file_version()))
+    filepath = ensure_data_directory(filename)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_filepath = Path(tmp_dir, filename)
+        with gzip.open(str(tmp_filepath), 'wt') as tmp_changes_file:
+            writer = csv.writer(tmp_changes_file, delimiter="\t")
+            writer.writerow(['Change'] + csv_header)
+            for change, row in changes:
+                writer.writerow([change] + row)
         shutil.move(str(tmp_filepath), str(filepath))
+    logging.info('{} changes in the google ads {} account structure'.format(len(changes),
+                                                                           account_structure_type.value))
+    return [{'data_set': '{}-account-structure-changes'.format(account_structure_type.value),
+             'partition': None,
+             'file': str(filename)}]
+
+
+def _download_account_structure_shard(api_client: AdWordsApiClient, account_structure_type: AccountStructureType,
+                                      csv_header: [str], attribute_cache: {} = None) -> [{}]:
+    """Downloads the account structure of the client customers of a shard and writes it to one zipped csv
+    file per client customer (see merge_shards)
+
+    Returns:
+        A list with the downloaded partition and the directory of its partial files
+    """
+    directory = _shard_account_structure_directory(account_structure_type)
+    # client customers might have moved to other shards since the previous run
+    shutil.rmtree(str(directory), ignore_errors=True)
+    directory.mkdir(parents=True)
+
+    with profiling.allocation_snapshot('download {} account structure'.format(account_structure_type.value)), \
+            closing(_prefetch(_download_account_data(api_client, account_structure_type,
+                                                     attribute_cache))) as downloaded_account_data:
+        for client_customer_id, campaign_attributes, ad_group_attributes, account_data in downloaded_account_data:
+            filepath = Path(directory, '{}.csv.gz'.format(client_customer_id))
+            with metrics.timer('stage_seconds', stage='serialize', report_type=account_structure_type.name,
+                               client_customer_id=client_customer_id), \
+                    gzip.open(str(filepath) + '.tmp', 'wt', compresslevel=1) as partial_file:
+                writer = csv.writer(partial_file, delimiter="\t")
+                writer.writerow(csv_header)
+                _write_account_structure_rows(writer, account_structure_type, api_client.client_customers,
+                                              client_customer_id, campaign_attributes, ad_group_attributes,
+                                              account_data)
+            os.replace(str(filepath) + '.tmp', str(filepath))
+
+    return [{'data_set': '{}-account-structure'.format(account_structure_type.value),
+             'partition': None,
+             'file': str(directory.relative_to(config.data_dir()))}]
+
+
+def _download_account_data(api_client: AdWordsApiClient, account_structure_type: AccountStructureType,
+                           attribute_cache: {} = None) -> iter:
+    """Downloads the campaign attributes, ad group attributes and ads or keywords of all client customers
+
+    Args:
+        api_client: An AdWordsApiClient
+        account_structure_type: The type of the account structure (ad or keyword)
+        attribute_cache: (optional) A dictionary in which the campaign and ad group attributes are kept
+            by client customer id
+
+    Returns:
+        An iterator over (client customer id, campaign attributes, ad group attributes, account data) tuples
+    """
+    if attribute_cache is None:
+        attribute_cache = {}
+    for client_customer_id in api_client.client_customers.keys():
+        campaign_attributes, ad_group_attributes = _client_customer_attributes(api_client, client_customer_id,
+                                                                               attribute_cache)
+        yield (client_customer_id, campaign_attributes, ad_group_attributes,
+               _get_account_data(api_client, account_structure_type, client_customer_id))
+
+
+def _client_customer_attributes(api_client: AdWordsApiClient, client_customer_id: int,
+                                attribute_cache: {}) -> ({}, {}):
+    """Returns the campaign attributes and the ad group attributes of a client customer,
+    downloads them when they are not in the attribute cache yet"""
+    if client_customer_id not in attribute_cache:
+        attribute_cache[client_customer_id] = (get_campaign_attributes(api_client, client_customer_id),
+                                               get_ad_group_attributes(api_client, client_customer_id))
+    return attribute_cache[client_customer_id]
+
+
+def _get_account_data(api_client: AdWordsApiClient, account_structure_type: AccountStructureType,
+                      client_customer_id: int) -> [(rows.ReportRow, {})]:
+    """Downloads the ads or the keywords of a client customer, depending on the account structure type"""
+    if account_structure_type == AccountStructureType.AD_ACCOUNT_STRUCTURE:
+        return get_ad_data(api_client, client_customer_id)
+    else:
+        return get_keyword_data(api_client, client_customer_id)
+
+
+def _write_account_structure_rows(writer: csv.writer, account_structure_type: AccountStructureType,
+                                  client_customers: {}, client_customer_id: int, campaign_attributes: {},
+                                  ad_group_attributes: {}, account_data: [(rows.ReportRow, {})]):
+    """Writes the ads or keywords of a client customer to the account structure file
+
+    Args:
+        writer: A csv writer for the account structure file
+        account_structure_type: The type of the account structure (ad or keyword)
+        client_customers: The client customers of the AdWordsApiClient
+        client_customer_id: A client customer id
+        campaign_attributes: The attributes of the campaigns of the client customer by campaign id
+        ad_group_attributes: The attributes of the ad groups of the client customer by ad group id
+        account_data: The ads or keywords of the client customer as (row, attributes) tuples
+    """
+    client_customer = client_customers[client_customer_id]
+    labels = json.dumps(client_customer['Labels'])
+    client_customer_attributes = parse_labels(labels)
+    client_customer_name = client_customer['Name']
+    main_key_prefix = 'Ad' if account_structure_type == AccountStructureType.AD_ACCOUNT_STRUCTURE else 'Keyword'
+
+    # the merged attributes of the client customer, campaign and ad group (and their json
+    # serialization) by (campaign id, ad group id), shared by all ads of an ad group
+    parent_attribute_layers = {}
+    currency_code = client_customer['Currency Code']
+
+    for row, row_attributes in account_data:
+        ad_id = row[f'{main_key_prefix} ID']
+        campaign_id = row['Campaign ID']
+        ad_group_id = row['Ad group ID']
+        parent_attribute_layer = parent_attribute_layers.get((campaign_id, ad_group_id))
+        if parent_attribute_layer is None:
+            parent_attributes = {**client_customer_attributes,
+                                 **campaign_attributes.get(campaign_id, {}),
+                                 **ad_group_attributes.get(ad_group_id, {})}
+            parent_attribute_layer = (parent_attributes, json.dumps(parent_attributes))
+            parent_attribute_layers[(campaign_id, ad_group_id)] = parent_attribute_layer
+
+        ad = [str(ad_id),
+              row[f'{main_key_prefix}'],
+              str(ad_group_id),
+              row['Ad group'],
+              str(campaign_id),
+              row['Campaign'],
+              str(client_customer_id),
+              client_customer_name,
+              _merge_attributes_json(*parent_attribute_layer, row_attributes),
+              currency_code
+              ]
+
+        writer.writerow(ad)
+
+
+def _merge_attributes_json(parent_attributes: {}, parent_attributes_json: str, attributes: {}) -> str:
+    """Serializes the attributes of an ad or keyword merged with the attributes of its parents,
+    the output is the same as json.dumps({**parent_attributes, **attributes})
+
+    Args:
+        parent_attributes: The merged attributes of the client customer, campaign and ad group
+        parent_attributes_json: The json serialization of parent_attributes
+        attributes: The attributes of the ad or keyword, which overwrite those of the parents
+
+    Returns:
+        A json object
+    """
+    if not attributes:
+        return parent_attributes_json
+    if not parent_attributes:
+        return json.dumps(attributes)
+    if parent_attributes.keys().isdisjoint(attributes.keys()):
+        # the attributes of the ad are appended to the serialized attributes of the parents
+        return parent_attributes_json[:-1] + ', ' + json.dumps(attributes)[1:]
+    return json.dumps({**parent_attributes, **attributes})
 
 
 def get_campaign_attributes(api_client: AdWordsApiClient, client_customer_id: int) -> {}:
@@ -359,7 +1675,46 @@ def get_ad_group_attributes(api_client: AdWordsApiClient, client_customer_id: in
     return {row['Ad group ID']: parse_labels(row['Labels']) for row in report}
 
 
-def get_ad_data(api_client: AdWordsApiClient, client_customer_id: int) -> [{}]:
+def get_account_changes(api_client: AdWordsApiClient, client_customer_id: int, campaign_ids: [int],
+                        since: datetime, until: datetime) -> bool:
+    """Asks the CustomerSyncService whether campaigns, ad groups, ads or keywords of a client customer changed
+    https://developers.google.com/adwords/api/docs/reference/v201809/CustomerSyncService
+
+    Args:
+        api_client: An AdWordsApiClient
+        client_customer_id: A client customer id
+        campaign_ids: The ids of all campaigns of the client customer
+        since: The start of the time range (UTC)
+        until: The end of the time range (UTC)
+
+    Returns:
+        True when something changed or the changes could not be determined, False otherwise
+    """
+    if not campaign_ids:
+        # new campaigns change the campaign attributes
+        return False
+
+    logging.info('get changes for account {}'.format(client_customer_id))
+    api_client.SetClientCustomerId(client_customer_id)
+    labels = {'report_type': 'CustomerSyncService', 'client_customer_id': client_customer_id}
+    service = api_client.GetService(service_name='CustomerSyncService')
+    rate_limiter.rate_limiter().acquire()
+    metrics.increment('api_requests', **labels)
+    try:
+        with metrics.timer('api_request_seconds', **labels):
+            customer_change_data = service.get({
+                'dateTimeRange': {'min': since.strftime('%Y%m%d %H%M%S UTC'),
+                                  'max': until.strftime('%Y%m%d %H%M%S UTC')},
+                'campaignIds': campaign_ids})
+    except errors.GoogleAdsError as e:
+        # e.g. when the time range is too long ago
+        metrics.increment('api_errors', error=type(e).__name__, **labels)
+        logging.warning('could not get the changes of account {}: {}'.format(client_customer_id, e))
+        return True
+    return bool(getattr(customer_change_data, 'changedCampaigns', None))
+
+
+def get_ad_data(api_client: AdWordsApiClient, client_customer_id: int) -> [(rows.ReportRow, {})]:
     """Downloads the ad data from the Google AdWords API for a given client_customer_id
     https://developers.google.com/adwords/api/docs/appendix/reports/ad-performance-report
 
@@ -368,7 +1723,7 @@ def get_ad_data(api_client: AdWordsApiClient, client_customer_id: int) -> [{}]:
         client_customer_id: A client customer id
 
     Returns:
-        A list of dictionaries with ad data
+        A list of (row, attributes) tuples with the ad data and the attributes of each ad
     """
     logging.info('get ad data for account {}'.format(client_customer_id))
 
@@ -406,12 +1761,12 @@ def get_ad_data(api_client: AdWordsApiClient, client_customer_id: int) -> [{}]:
             attributes = {**attributes, 'Ad type': row['Ad type']}
         if row['Ad state'] is not None:
             attributes = {**attributes, 'Ad state': row['Ad state']}
-        ad_data.append({**row, 'attributes': attributes})
+        ad_data.append((row, attributes))
 
     return ad_data
 
 
-def get_keyword_data(api_client: AdWordsApiClient, client_customer_id: int) -> [{}]:
+def get_keyword_data(api_client: AdWordsApiClient, client_customer_id: int) -> [(rows.ReportRow, {})]:
     """Downloads the keyword data from the Google AdWords API for a given client_customer_id
     https://developers.google.com/adwords/api/docs/appendix/reports/keywords-performance-report
 
@@ -420,7 +1775,7 @@ def get_keyword_data(api_client: AdWordsApiClient, client_customer_id: int) -> [
         client_customer_id: A client customer id
 
     Returns:
-        A list of dictionaries with keyword data
+        A list of (row, attributes) tuples with the keyword data and the attributes of each keyword
     """
     logging.info('get keyword data for account {}'.format(client_customer_id))
 
@@ -455,7 +1810,7 @@ def get_keyword_data(api_client: AdWordsApiClient, client_customer_id: int) -> [
         attributes = parse_labels(row['Labels'])
         if row['Keyword state'] is not None:
             attributes = {**attributes, 'Keyword state': row['Keyword state']}
-        keyword_data.append({**row, 'attributes': attributes})
+        keyword_data.append((row, attributes))
 
     return keyword_data
 
@@ -464,7 +1819,8 @@ def _download_adwords_report(api_client: AdWordsApiClient,
                              report_type: str,
                              fields: [str],
                              predicates: {},
-                             current_date: datetime = None) -> csv.DictReader:
+                             current_date: datetime = None,
+                             last_date: datetime = None) -> iter:
     """Downloads an Google Ads report from the Google Ads API
 
     Args:
@@ -476,9 +1832,11 @@ def _download_adwords_report(api_client: AdWordsApiClient,
         predicates: The predicate to filter by
             https://developers.google.com/adwords/api/docs/reference/v201609/CampaignService.Predicate
         current_date: datetime (optional), if none is specified today's date is assumed
+        last_date: datetime (optional), the last day of a date range starting at current_date,
+            if none is specified only current_date is requested
 
     Returns:
-        A Google Ads report as a string
+        An iterator over the rows of the report as rows.ReportRow objects, parsed incrementally
 
     """
     report_filter = {
@@ -493,49 +1851,170 @@ def _download_adwords_report(api_client: AdWordsApiClient,
     }
 
     if current_date is not None:
-        date_str = current_date.strftime('%Y%m%d')
         report_filter['selector']['dateRange'] = {
-            'min': date_str,
-            'max': date_str
+            'min': current_date.strftime('%Y%m%d'),
+            'max': (last_date or current_date).strftime('%Y%m%d')
         }
     else:
         report_filter['dateRangeType'] = 'TODAY'
 
+    labels = {'report_type': report_type, 'client_customer_id': api_client.client_customer_id}
+
+    if report_cache.is_enabled():
+        cache_key = report_cache.report_key(api_client.client_customer_id, report_filter)
+        cached_report = report_cache.get(cache_key, ttl=int(config.report_cache_ttl()),
+                                         final_since=_report_final_since(last_date or current_date))
+        if cached_report:
+            metrics.increment('report_cache_hits', **labels)
+            cached_report_file = gzip.open(str(cached_report), 'rb')
+            return _parse_report(codecs.iterdecode(cached_report_file, 'utf-8'), labels, cached_report_file)
+
     report_downloader = api_client.GetReportDownloader(version=config.api_version())
 
     retry_count = 0
     while True:
         retry_count += 1
+        rate_limiter.rate_limiter().acquire()
+        metrics.increment('api_requests', **labels)
         try:
-            report = io.StringIO()
-            report_downloader.DownloadReport(report_filter,
-                                             output=report,
-                                             skip_report_header=True,
-                                             skip_column_header=False,
-                                             skip_report_summary=True)
-            report.seek(0)
-            return csv.DictReader(report)
+            # the report is spooled to disk before parsing, so that the whole download can be retried,
+            # it is closed when the attempt fails or when the report was parsed
+            report = tempfile.SpooledTemporaryFile(max_size=_REPORT_SPOOL_MAX_SIZE)
+            try:
+                with metrics.timer('api_request_seconds', **labels):
+                    stream = report_downloader.DownloadReportAsStream(report_filter,
+                                                                      skip_report_header=True,
+                                                                      skip_column_header=False,
+                                                                      skip_report_summary=True)
+                    try:
+                        shutil.copyfileobj(stream, report)
+                    finally:
+                        stream.close()
+                metrics.increment('report_bytes', report.tell(), **labels)
+                report.seek(0)
+                if report_cache.is_enabled():
+                    report_cache.put(cache_key, report)
+                    report.seek(0)
+            except BaseException:
+                report.close()
+                raise
+            return _parse_report(codecs.iterdecode(report, 'utf-8'), labels, report)
         except errors.AdWordsReportError as e:
+            metrics.increment('api_errors', error='HTTP {}'.format(e.code), **labels)
             if retry_count < config.max_retries():
+                metrics.increment('api_retries', **labels)
 
                 logging.warning(('Error HTTP #{e.code} Failed attempt #{retry_count} for report with settings:\n'
                                  '{report_filter}\n'
                                  'Retrying...').format(e=e, retry_count=retry_count,
                                                        report_filter=report_filter))
-                time.sleep(retry_count * config.retry_backoff_factor())
+                time.sleep(_retry_delay(retry_count, e))
             else:
                 raise e
         except http.client.RemoteDisconnected as e:
+            metrics.increment('api_errors', error='RemoteDisconnected', **labels)
             if retry_count < config.max_retries():
+                metrics.increment('api_retries', **labels)
                 logging.warning(('Network error during attempt #{retry_count} for report with settings:\n'
                                  '{report_filter}\n'
                                  'Retrying...').format(retry_count=retry_count,
                                                        report_filter=report_filter))
-                time.sleep(retry_count * config.retry_backoff_factor())
+                time.sleep(_retry_delay(retry_count, e))
             else:
                 raise e
 
 
+def _parse_report(lines: iter, labels: {}, report_file=None) -> iter:
+    """Parses a report (see rows.parse_report) and records the number of rows and the time spent in metrics
+
+    Args:
+        lines: An iterator over the lines of the report
+        labels: The labels of the metrics
+        report_file: (optional) The file from which the lines are read, is closed when the report was parsed
+            or when the iteration is stopped
+    """
+    report_rows = rows.parse_report(lines)
+    number_of_rows = 0
+    seconds = 0.0
+    try:
+        while True:
+            started_at = time.perf_counter()
+            row = next(report_rows, None)
+            seconds += time.perf_counter() - started_at
+            if row is None:
+                break
+            number_of_rows += 1
+            yield row
+    finally:
+        if report_file is not None:
+            report_file.close()
+    metrics.increment('report_rows', number_of_rows, **labels)
+    metrics.observe('stage_seconds', seconds, stage='parse', **labels)
+
+
+# The maximum number of seconds to wait between two retries
+_MAX_RETRY_DELAY = 600
+
+
+def _retry_delay(retry_count: int, error: Exception) -> float:
+    """How many seconds to wait before retrying a failed request
+
+    Args:
+        retry_count: The number of the failed attempt
+        error: The error of the failed attempt
+
+    Returns:
+        The number of seconds the server asked to wait for, or an exponential backoff
+        of `config.retry_backoff_factor()` seconds with jitter
+    """
+    retry_after = _retry_after_seconds(error)
+    if retry_after is not None:
+        # all other requests need to wait as well
+        rate_limiter.rate_limiter().pause(retry_after)
+        return retry_after
+    delay = min(_MAX_RETRY_DELAY, float(config.retry_backoff_factor()) * 2 ** (retry_count - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _retry_after_seconds(error: Exception) -> float:
+    """Extracts the number of seconds to wait before retrying from the Retry-After header or
+    the retryAfterSeconds field of a rate exceeded error, None if the error does not contain any"""
+    headers = getattr(getattr(error, 'error', None), 'headers', None)
+    if headers is not None and headers.get('Retry-After', '').strip().isdigit():
+        return float(headers.get('Retry-After'))
+
+    content = getattr(error, 'content', None) or ''
+    if isinstance(content, bytes):
+        content = content.decode('utf-8', errors='replace')
+    match = re.search(r'retryAfterSeconds>\s*(\d+)', content)
+    if match:
+        return float(match.group(1))
+
+    for api_error in getattr(error, 'errors', None) or []:
+        retry_after = getattr(api_error, 'retryAfterSeconds', None)
+        if retry_after:
+            return float(retry_after)
+    return None
+
+
+def _report_final_since(last_date: datetime = None) -> datetime:
+    """When the last day of a report left the redownload window, so that its data does not change anymore
+
+    Reports that were cached before are only valid for `config.report_cache_ttl()` seconds, also once
+    the day is older, as they might contain data of the day from when it still changed.
+
+    Args:
+        last_date: The last day of the report, None for reports without dates
+
+    Returns:
+        The start of the first day on which last_date is older than the redownload window,
+        None for reports without dates
+    """
+    if last_date is None:
+        return None
+    return _start_of_day(last_date) + datetime.timedelta(days=int(config.redownload_window()) + 2)
+
+
 class ClientConfigBuilder(object):
     """Helper class used to build a client config dict used in the OAuth 2.0 flow."""
 
@@ -0,0 +1,290 @@
+"""
+A local stand-in for the Google Ads API that produces synthetic reports, for measuring the downloader without credentials
+"""
+import csv
+import datetime
+import http.client
+import io
+import random
+import threading
+import time
+import types
+import urllib.error
+
+from google_ads_downloader import downloader
+from googleads import errors
+
+# The csv column names of the report fields, as returned by the Google Ads API
+_COLUMN_NAMES = {
+    'Date': 'Day',
+    'AdGroupId': 'Ad group ID',
+    'AdGroupName': 'Ad group',
+    'CampaignId': 'Campaign ID',
+    'CampaignName': 'Campaign',
+    'Labels': 'Labels',
+    'Headline': 'Ad',
+    'AdType': 'Ad type',
+    'Criteria': 'Keyword',
+    'Device': 'Device',
+    'AdNetworkType2': 'Network (with search partners)',
+    'ActiveViewImpressions': 'Active View viewable impressions',
+    'AveragePosition': 'Avg. position',
+    'Clicks': 'Clicks',
+    'Conversions': 'Conversions',
+    'ConversionValue': 'Total conv. value',
+    'Cost': 'Cost',
+    'Impressions': 'Impressions'
+}
+
+_DEVICES = ['Computers', 'Mobile devices with full browsers', 'Tablets with full browsers']
+_NETWORKS = ['Google search', 'Search partners', 'Display Network']
+
+
+class FakeApiStatistics:
+    """Counts the requests and rows of all clients that share it"""
+
+    def __init__(self):
+        self.requests = 0
+        self.failed_requests = 0
+        self.rows = 0
+        self._lock = threading.Lock()
+
+    def count(self, rows: int = 0, failed: bool = False):
+        with self._lock:
+            self.requests += 1
+            self.rows += rows
+            if failed:
+                self.failed_requests += 1
+
+
+class FakeAdWordsApiClient:
+    """Mimics the parts of downloader.AdWordsApiClient that are used for downloading data
+
+    The client customers are fetched from a FakeManagedCustomerService with the paged listing of
+    downloader.AdWordsApiClient when they are first used, so that the configuration can be set after
+    the client was created.
+    """
+
+    # the client customers are discovered like by the real client
+    _fetch_managed_customer_page = downloader.AdWordsApiClient._fetch_managed_customer_page
+    _fetch_client_customers = downloader.AdWordsApiClient._fetch_client_customers
+
+    def __init__(self, number_of_client_customers: int = 10, ads_per_client_customer: int = 100,
+                 ads_per_ad_group: int = 20, ad_groups_per_campaign: int = 5, latency: float = 0.0,
+                 error_rate: float = 0.0, disconnect_rate: float = 0.0, change_rate: float = 0.0, seed: int = 0,
+                 statistics: FakeApiStatistics = None):
+        """
+        Args:
+            number_of_client_customers: How many client customers the manager account has
+            ads_per_client_customer: How many ads (and keywords) each client customer has, each ad has
+                one performance row per device and network and day
+            ads_per_ad_group: How many ads each ad group has
+            ad_groups_per_campaign: How many ad groups each campaign has
+            latency: How many seconds each report request takes
+            error_rate: The fraction of report requests that fail with an AdWordsReportError
+            disconnect_rate: The fraction of report requests that fail with a RemoteDisconnected error
+            change_rate: The fraction of CustomerSyncService requests that report changed campaigns
+            seed: The seed for the random errors
+            statistics: (optional) A FakeApiStatistics object to count requests in, shared with worker clients
+        """
+        self.ads_per_client_customer = ads_per_client_customer
+        self.ads_per_ad_group = ads_per_ad_group
+        self.ad_groups_per_campaign = ad_groups_per_campaign
+        self.latency = latency
+        self.error_rate = error_rate
+        self.disconnect_rate = disconnect_rate
+        self.change_rate = change_rate
+        self.seed = seed
+        self.statistics = statistics or FakeApiStatistics()
+        self.client_customer_id = None
+        # the accounts below the manager account ordered by customer id, including a manager account
+        # that is not downloaded
+        self.managed_customers = [
+            types.SimpleNamespace(customerId=999999999, name='Sub manager', canManageClients=True,
+                                  accountLabels=[], currencyCode='EUR')] + [
+            types.SimpleNamespace(customerId=1000000000 + index, name='Account {}'.format(index),
+                                  canManageClients=False,
+                                  accountLabels=[types.SimpleNamespace(
+                                      name='{{Channel={}}}'.format('SEM' if index % 2 else 'Display'))],
+                                  currencyCode='EUR')
+            for index in range(number_of_client_customers)]
+        self._client_customers = None
+        self._random = random.Random(seed)
+
+    @property
+    def client_customers(self) -> {int: {}}:
+        if self._client_customers is None:
+            self.refresh_client_customers()
+        return self._client_customers
+
+    @client_customers.setter
+    def client_customers(self, client_customers: {int: {}}):
+        self._client_customers = client_customers
+
+    def create_worker_client(self) -> 'FakeAdWordsApiClient':
+        worker_client = FakeAdWordsApiClient(0, self.ads_per_client_customer, self.ads_per_ad_group,
+                                             self.ad_groups_per_campaign, self.latency, self.error_rate,
+                                             self.disconnect_rate, self.change_rate,
+                                             self._random.randint(0, 2 ** 32), self.statistics)
+        worker_client.client_customers = self.client_customers
+        return worker_client
+
+    def refresh_client_customers(self):
+        self._client_customers = self._fetch_client_customers()
+
+    def SetClientCustomerId(self, client_customer_id: int):
+        self.client_customer_id = client_customer_id
+
+    def GetReportDownloader(self, version: str = None) -> 'FakeReportDownloader':
+        return FakeReportDownloader(self)
+
+    def GetService(self, service_name: str, version: str = None):
+        if service_name == 'CustomerSyncService':
+            return FakeCustomerSyncService(self)
+        if service_name == 'ManagedCustomerService':
+            return FakeManagedCustomerService(self)
+        raise NotImplementedError(service_name)
+
+
+class FakeManagedCustomerService:
+    """Mimics the ManagedCustomerService by listing the managed customers of the client page by page"""
+
+    def __init__(self, client: FakeAdWordsApiClient):
+        self.client = client
+
+    def get(self, selector: {}) -> types.SimpleNamespace:
+        client = self.client
+        if client.latency:
+            time.sleep(client.latency)
+        client.statistics.count()
+        start_index = selector['paging']['startIndex']
+        entries = client.managed_customers[start_index:start_index + selector['paging']['numberResults']]
+        return types.SimpleNamespace(totalNumEntries=len(client.managed_customers), entries=entries)
+
+
+class FakeCustomerSyncService:
+    """Mimics the CustomerSyncService by reporting changes of random campaigns"""
+
+    def __init__(self, client: FakeAdWordsApiClient):
+        self.client = client
+
+    def get(self, selector: {}) -> types.SimpleNamespace:
+        client = self.client
+        if client.latency:
+            time.sleep(client.latency)
+        client.statistics.count()
+        changed_campaigns = []
+        if client._random.random() < client.change_rate:
+            changed_campaigns = [types.SimpleNamespace(campaignId=selector['campaignIds'][0],
+                                                       campaignChangeStatus='FIELDS_UNCHANGED',
+                                                       changedAdGroups=[])]
+        return types.SimpleNamespace(changedCampaigns=changed_campaigns,
+                                     lastChangeTimestamp=selector['dateTimeRange']['max'])
+
+
+class FakeReportDownloader:
+    """Mimics googleads.adwords.ReportDownloader by generating csv reports"""
+
+    def __init__(self, client: FakeAdWordsApiClient):
+        self.client = client
+
+    def DownloadReportAsStream(self, report_filter: {}, skip_report_header: bool = False,
+                               skip_column_header: bool = False, skip_report_summary: bool = False,
+                               **kwargs) -> io.BytesIO:
+        client = self.client
+        if client.latency:
+            time.sleep(client.latency)
+
+        failure = client._random.random()
+        if failure < client.error_rate:
+            client.statistics.count(failed=True)
+            raise errors.AdWordsReportError(
+                500, urllib.error.HTTPError('https://adwords.google.com/api/adwords/reportdownload', 500,
+                                            'Internal Server Error', {}, None),
+                'Internal Server Error')
+        if failure < client.error_rate + client.disconnect_rate:
+            client.statistics.count(failed=True)
+            raise http.client.RemoteDisconnected('Remote end closed connection without response')
+
+        header, rows = _report(client, report_filter)
+        report = io.StringIO()
+        writer = csv.writer(report)
+        if not skip_column_header:
+            writer.writerow(header)
+        number_of_rows = 0
+        for row in rows:
+            writer.writerow(row)
+            number_of_rows += 1
+        client.statistics.count(rows=number_of_rows)
+        return io.BytesIO(report.getvalue().encode())
+
+
+def _report(client: FakeAdWordsApiClient, report_filter: {}) -> ([str], iter):
+    """Generates the column header and the rows of a report
+
+    Returns:
+        A tuple of the column names and an iterator over the rows
+    """
+    report_type = report_filter['reportType']
+    fields = report_filter['selector']['fields']
+    id_column = 'Keyword ID' if report_type == 'KEYWORDS_PERFORMANCE_REPORT' else 'Ad ID'
+    state_column = 'Keyword state' if report_type == 'KEYWORDS_PERFORMANCE_REPORT' else 'Ad state'
+    header = [id_column if field == 'Id' else state_column if field == 'Status' else _COLUMN_NAMES[field]
+              for field in fields]
+
+    client_customer_id = client.client_customer_id
+    days = [None]
+    if 'dateRange' in report_filter['selector']:
+        first_date = datetime.datetime.strptime(report_filter['selector']['dateRange']['min'], '%Y%m%d')
+        last_date = datetime.datetime.strptime(report_filter['selector']['dateRange']['max'], '%Y%m%d')
+        days = [first_date + datetime.timedelta(days=offset) for offset in range((last_date - first_date).days + 1)]
+
+    if report_type == 'ACCOUNT_PERFORMANCE_REPORT':
+        entities = [0]
+        segments = [(None, None)]
+    elif report_type == 'CAMPAIGN_PERFORMANCE_REPORT':
+        entities = range(0, client.ads_per_client_customer,
+                         client.ads_per_ad_group * client.ad_groups_per_campaign)
+        segments = [(None, None)]
+    elif report_type == 'ADGROUP_PERFORMANCE_REPORT':
+        entities = range(0, client.ads_per_client_customer, client.ads_per_ad_group)
+        segments = [(None, None)]
+    elif 'Device' in fields:
+        entities = range(client.ads_per_client_customer)
+        segments = [(device, network) for device in _DEVICES for network in _NETWORKS[:2]]
+    else:
+        entities = range(client.ads_per_client_customer)
+        segments = [(None, None)]
+
+    def rows():
+        for day in days:
+            for entity in entities:
+                ad_group = entity // client.ads_per_ad_group
+                campaign = ad_group // client.ad_groups_per_campaign
+                for device, network in segments:
+                    # deterministic values, so that repeated downloads do not change the output
+                    impressions = (entity * 7 + (day.toordinal() if day else 0)) % 1000 + 1
+                    values = {
+                        'Date': day.strftime('%Y-%m-%d') if day else None,
+                        'Id': str(client_customer_id * 100000 + entity),
+                        'AdGroupId': str(client_customer_id * 1000 + ad_group),
+                        'AdGroupName': 'Ad group {}'.format(ad_group),
+                        'CampaignId': str(client_customer_id * 100 + campaign),
+                        'CampaignName': 'Campaign {}'.format(campaign),
+                        'Labels': '["{{Target={}}}"]'.format('buyer' if entity % 3 else 'seller'),
+                        'Headline': 'Ad {}'.format(entity),
+                        'AdType': 'Expanded text ad',
+                        'Criteria': 'keyword {}'.format(entity),
+                        'Status': 'enabled',
+                        'Device': device,
+                        'AdNetworkType2': network,
+                        'ActiveViewImpressions': '0',
+                        'AveragePosition': '{:.1f}'.format(1 + entity % 4),
+                        'Clicks': str(impressions // 10),
+                        'Conversions': '{:.2f}'.format(impressions / 1000),
+                        'ConversionValue': '{:.2f}'.format(impressions / 100),
+                        'Cost': str(impressions * 10000),
+                        'Impressions': str(impressions)}
+                    yield [values[field] for field in fields]
+
+    return header, rows()
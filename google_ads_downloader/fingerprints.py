@@ -0,0 +1,73 @@
+"""
+Fingerprints of the content of downloaded files, to detect which files changed between runs
+"""
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from google_ads_downloader import config
+
+
+def fingerprint(serialized_rows: iter) -> str:
+    """Computes a fingerprint of rows that does not depend on the order of the rows
+
+    Args:
+        serialized_rows: An iterator over json encoded rows
+
+    Returns:
+        A hex digest of the sum of the sha256 hashes of all rows
+    """
+    return from_digest_sum(sum(row_digest(serialized_row) for serialized_row in serialized_rows))
+
+
+def row_digest(serialized_row: str) -> int:
+    """The sha256 hash of a single row as integer"""
+    return int.from_bytes(hashlib.sha256(serialized_row.encode()).digest(), 'big')
+
+
+def from_digest_sum(digest_sum: int) -> str:
+    """Turns a sum of row digests into a fingerprint"""
+    return '{:064x}'.format(digest_sum % 2 ** 256)
+
+
+def combine(partial_fingerprints: iter) -> str:
+    """Combines the fingerprints of disjoint sets of rows into the fingerprint of all rows"""
+    return from_digest_sum(sum(int(partial_fingerprint, 16) for partial_fingerprint in partial_fingerprints))
+
+
+def fingerprints_path(name: str) -> Path:
+    """The path of the file with the fingerprints of a data set"""
+    return Path(config.data_dir(), '.fingerprints', '{name}_{version}.json'.format(
+        name=name, version=config.output_file_version()))
+
+
+def load(name: str) -> {str: {}}:
+    """Reads the fingerprints of a data set
+
+    Args:
+        name: The name of the data set, e.g. 'ad-performance'
+
+    Returns:
+        A dictionary mapping partitions (e.g. days) to their fingerprints
+    """
+    path = fingerprints_path(name)
+    if not path.is_file():
+        return {}
+    with path.open() as fingerprints_file:
+        return json.load(fingerprints_file)
+
+
+def save(name: str, fingerprints: {str: {}}):
+    """Atomically replaces the fingerprints of a data set
+
+    Args:
+        name: The name of the data set, e.g. 'ad-performance'
+        fingerprints: A dictionary mapping partitions (e.g. days) to their fingerprints
+    """
+    path = fingerprints_path(name)
+    path.parent.mkdir(exist_ok=True, parents=True)
+    with tempfile.NamedTemporaryFile('w', dir=str(path.parent), delete=False) as tmp_file:
+        json.dump(fingerprints, tmp_file, sort_keys=True)
+    os.replace(tmp_file.name, str(path))
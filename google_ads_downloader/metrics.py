@@ -0,0 +1,151 @@
+"""
+Counters and timing histograms of a run, exported as json summary and optionally in the Prometheus textfile format
+"""
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# The upper bounds of the histogram buckets in seconds
+_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, math.inf)
+
+# The prefix of all metric names in the Prometheus textfile
+_PROMETHEUS_PREFIX = 'google_ads_downloader_'
+
+_counters = {}
+_histograms = {}
+_lock = threading.Lock()
+
+
+def increment(name: str, value: float = 1, **labels):
+    """Increments a counter
+
+    Args:
+        name: The name of the counter, e.g. 'api_requests'
+        value: The value to add
+        labels: The labels of the counter, e.g. report_type='AD_PERFORMANCE_REPORT'
+    """
+    key = (name, _label_items(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, seconds: float, **labels):
+    """Records a duration in a histogram
+
+    Args:
+        name: The name of the histogram, e.g. 'api_request_seconds'
+        seconds: The duration
+        labels: The labels of the histogram, e.g. report_type='AD_PERFORMANCE_REPORT'
+    """
+    key = (name, _label_items(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {'count': 0, 'sum': 0.0, 'min': math.inf, 'max': 0.0,
+                                            'buckets': [0] * len(_BUCKETS)}
+        histogram['count'] += 1
+        histogram['sum'] += seconds
+        histogram['min'] = min(histogram['min'], seconds)
+        histogram['max'] = max(histogram['max'], seconds)
+        for index, upper_bound in enumerate(_BUCKETS):
+            if seconds <= upper_bound:
+                histogram['buckets'][index] += 1
+                break
+
+
+@contextmanager
+def timer(name: str, **labels):
+    """Records the duration of a block in a histogram (see observe)"""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started_at, **labels)
+
+
+def summary() -> {}:
+    """Returns all counters and histograms
+
+    Returns:
+        A dictionary with a list of 'counters' (name, labels and value) and a list of 'histograms'
+        (name, labels, count, sum, min and max)
+    """
+    with _lock:
+        return {'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in sorted(_counters.items())],
+                'histograms': [{'name': name, 'labels': dict(labels), 'count': histogram['count'],
+                                'sum': round(histogram['sum'], 6), 'min': round(histogram['min'], 6),
+                                'max': round(histogram['max'], 6)}
+                               for (name, labels), histogram in sorted(_histograms.items())]}
+
+
+def write_summary(path: Path, **fields):
+    """Atomically writes the summary of all metrics as json
+
+    Args:
+        path: The file to write to
+        fields: Additional fields of the summary, e.g. started_at
+    """
+    _write_atomically(path, json.dumps({**fields, **summary()}, indent=2, default=str))
+
+
+def write_prometheus_textfile(path: Path):
+    """Atomically writes all metrics in the Prometheus text format, e.g. for the textfile collector
+    of the node exporter"""
+    _write_atomically(path, prometheus_text())
+
+
+def prometheus_text() -> str:
+    """Returns all metrics in the Prometheus text format"""
+    lines = []
+    with _lock:
+        for name in sorted({name for name, _ in _counters.keys()}):
+            lines.append('# TYPE {}{}_total counter'.format(_PROMETHEUS_PREFIX, name))
+            for (counter_name, labels), value in sorted(_counters.items()):
+                if counter_name == name:
+                    lines.append('{}{}_total{} {}'.format(_PROMETHEUS_PREFIX, name, _prometheus_labels(labels), value))
+        for name in sorted({name for name, _ in _histograms.keys()}):
+            lines.append('# TYPE {}{} histogram'.format(_PROMETHEUS_PREFIX, name))
+            for (histogram_name, labels), histogram in sorted(_histograms.items()):
+                if histogram_name != name:
+                    continue
+                cumulative_count = 0
+                for upper_bound, count in zip(_BUCKETS, histogram['buckets']):
+                    cumulative_count += count
+                    bucket_labels = labels + (('le', '+Inf' if upper_bound == math.inf else str(upper_bound)),)
+                    lines.append('{}{}_bucket{} {}'.format(_PROMETHEUS_PREFIX, name,
+                                                           _prometheus_labels(bucket_labels), cumulative_count))
+                lines.append('{}{}_sum{} {}'.format(_PROMETHEUS_PREFIX, name, _prometheus_labels(labels),
+                                                    histogram['sum']))
+                lines.append('{}{}_count{} {}'.format(_PROMETHEUS_PREFIX, name, _prometheus_labels(labels),
+                                                      histogram['count']))
+    return '\n'.join(lines) + '\n'
+
+
+def _label_items(labels: {}) -> ((str, str),):
+    """Turns labels into a hashable, sorted tuple of (name, value) pairs"""
+    return tuple(sorted((name, str(value)) for name, value in labels.items() if value is not None))
+
+
+def _prometheus_labels(labels: ((str, str),)) -> str:
+    """Formats labels as {name="value",..}"""
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, value.replace('\\', '\\\\').replace('"', '\\"')
+                                           .replace('\n', '\\n'))
+                          for name, value in labels) + '}'
+
+
+def _write_atomically(path: Path, content: str):
+    """Replaces a file with new content"""
+    path.parent.mkdir(exist_ok=True, parents=True)
+    with tempfile.NamedTemporaryFile('w', dir=str(path.parent), delete=False) as tmp_file:
+        tmp_file.write(content)
+    # readable by other users, e.g. by the node exporter
+    os.chmod(tmp_file.name, 0o644)
+    os.replace(tmp_file.name, str(path))
@@ -0,0 +1,194 @@
+"""
+Writers for the file formats in which the performance of a day can be stored
+"""
+import datetime
+import gzip
+import json
+
+from google_ads_downloader import config
+from google_ads_downloader.rows import COLUMN_TYPES
+
+# The file extensions of the supported compression codecs
+COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+# How many rows are converted to columns at once when writing parquet files
+_PARQUET_ROW_GROUP_SIZE = 50000
+
+
+def file_extension() -> str:
+    """The file extension of performance files in the configured output format and compression"""
+    output_format = config.output_format()
+    if output_format == 'parquet':
+        return '.parquet'
+    elif output_format in ('json', 'ndjson'):
+        return '.' + output_format + COMPRESSION_EXTENSIONS[_compression()]
+    else:
+        raise ValueError('Unknown output format "{}", must be one of "json", "ndjson", "parquet"'
+                         .format(output_format))
+
+
+def write_performance_rows(serialized_rows: iter, file_path: str):
+    """Writes rows to a file in the configured output format without keeping all rows in memory
+
+    Args:
+        serialized_rows: An iterator over json encoded rows
+        file_path: The file to write to
+    """
+    output_format = config.output_format()
+    if output_format == 'parquet':
+        write_parquet(serialized_rows, file_path)
+    else:
+        with open_compressed(file_path, 'wt', _compression(), int(config.output_compression_level())) as file:
+            if output_format == 'ndjson':
+                write_json_lines(serialized_rows, file)
+            else:
+                write_json_array(serialized_rows, file)
+
+
+def open_compressed(file_path: str, mode: str = 'rt', compression: str = None, compression_level: int = 0):
+    """Opens a gzip or zstd compressed file
+
+    Args:
+        file_path: The file to open
+        mode: 'rt', 'rb', 'wt' or 'wb'
+        compression: (optional) 'gzip' or 'zstd', if none is specified it is determined from the file extension
+        compression_level: (optional) The compression level when writing, 0 for the default level of the codec
+
+    Returns:
+        A file object
+    """
+    if compression is None:
+        compression = 'zstd' if str(file_path).endswith(COMPRESSION_EXTENSIONS['zstd']) else 'gzip'
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImportError('zstd compression requires zstandard, '
+                              'install it with "pip install google-ads-performance-downloader[zstd]"') from e
+        if 'w' in mode:
+            return zstandard.open(file_path, mode, cctx=zstandard.ZstdCompressor(level=compression_level or 3))
+        return zstandard.open(file_path, mode)
+    if 'w' in mode:
+        return gzip.open(file_path, mode, compresslevel=compression_level or 9)
+    return gzip.open(file_path, mode)
+
+
+def write_json_array(serialized_rows: iter, file):
+    """Incrementally writes json encoded rows as a json array, the output is the same as
+    json.dumps(list_of_rows)
+
+    Args:
+        serialized_rows: An iterator over json encoded rows
+        file: A text file to write to
+    """
+    file.write('[')
+    separator = ''
+    for serialized_row in serialized_rows:
+        file.write(separator)
+        file.write(serialized_row)
+        separator = ', '
+    file.write(']')
+
+
+def write_json_lines(serialized_rows: iter, file):
+    """Writes json encoded rows as newline delimited json, one row per line
+
+    Args:
+        serialized_rows: An iterator over json encoded rows
+        file: A text file to write to
+    """
+    for serialized_row in serialized_rows:
+        file.write(serialized_row)
+        file.write('\n')
+
+
+def write_parquet(serialized_rows: iter, file_path: str):
+    """Writes rows to a parquet file with typed columns (see COLUMN_TYPES), one row group
+    per `_PARQUET_ROW_GROUP_SIZE` rows, compressed with the configured codec
+
+    Args:
+        serialized_rows: An iterator over json encoded rows
+        file_path: The file to write to
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError('Writing parquet files requires pyarrow, '
+                          'install it with "pip install google-ads-performance-downloader[parquet]"') from e
+
+    writer = None
+    columns = None
+    try:
+        for rows in _batches(map(json.loads, serialized_rows), _PARQUET_ROW_GROUP_SIZE):
+            if writer is None:
+                columns = list(rows[0].keys())
+                schema = pyarrow.schema([(column, _arrow_type(pyarrow, column)) for column in columns])
+                writer = pyarrow.parquet.ParquetWriter(
+                    file_path, schema, compression=_compression(),
+                    compression_level=int(config.output_compression_level()) or None)
+            writer.write_table(pyarrow.Table.from_pydict(
+                {column: [typed_value(column, row.get(column)) for row in rows] for column in columns},
+                schema=writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        # a day without performance
+        pyarrow.parquet.write_table(pyarrow.table({}), file_path)
+
+
+def typed_value(column: str, value: str):
+    """Converts a value of the performance report to the type of its column
+
+    Args:
+        column: The name of the column, e.g. 'Cost'
+        value: The value as returned by the Google Ads API
+
+    Returns:
+        The value as date, int, float or string, None for missing values (' --')
+    """
+    column_type = COLUMN_TYPES.get(column)
+    if column_type is None or column_type == 'category':
+        return value
+    if value is None:
+        return None
+    value = value.strip().replace(',', '')
+    if value in ('', '--'):
+        return None
+    if column_type == 'date':
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    elif column_type == 'int':
+        return int(value)
+    else:
+        return float(value)
+
+
+def _compression() -> str:
+    """The configured compression codec"""
+    compression = config.output_compression()
+    if compression not in COMPRESSION_EXTENSIONS:
+        raise ValueError('Unknown compression "{}", must be one of "gzip", "zstd"'.format(compression))
+    return compression
+
+
+def _arrow_type(pyarrow, column: str):
+    """The arrow type of a column of the performance report"""
+    return {'date': pyarrow.date32(),
+            'int': pyarrow.int64(),
+            'float': pyarrow.float64(),
+            'category': pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+            }.get(COLUMN_TYPES.get(column), pyarrow.string())
+
+
+def _batches(iterable: iter, size: int) -> iter:
+    """Splits an iterator into lists of at most size elements"""
+    batch = []
+    for element in iterable:
+        batch.append(element)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
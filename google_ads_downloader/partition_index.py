@@ -0,0 +1,131 @@
+"""
+An index of the performance files of each day with their size, checksum and download time, so that runs know
+which days were downloaded without checking the directory tree of the data directory day by day
+"""
+import datetime
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+from google_ads_downloader import compaction, config, output_formats
+
+# The format of the times in the index (UTC)
+_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+class PartitionIndex:
+    """The performance files of a data set by day ('%Y-%m-%d'), each with its 'file' (relative to the data
+    directory), 'size' in bytes, sha256 'checksum' and 'downloaded_at' time (UTC). The days of compacted months
+    point to the monthly file.
+
+    The index is only updated by this package, files that are removed by hand are still considered to exist
+    until the index file is removed (see index_path), which rebuilds it from the data directory.
+    """
+
+    def __init__(self, data_set: str, partitions: {str: {}} = None):
+        """
+        Args:
+            data_set: The name of the data set, e.g. 'ad-performance'
+            partitions: The entries of the index by day
+        """
+        self.data_set = data_set
+        self.partitions = partitions or {}
+
+    def file(self, partition: str) -> str:
+        """The file of a day relative to the data directory, None when the day was not downloaded"""
+        entry = self.partitions.get(partition)
+        return entry['file'] if entry else None
+
+    def downloaded_at(self, partition: str) -> datetime:
+        """When the file of a day was last written (UTC), None when the day was not downloaded"""
+        entry = self.partitions.get(partition)
+        return datetime.datetime.strptime(entry['downloaded_at'], _TIME_FORMAT) if entry else None
+
+    def add(self, partition: str, file: Path, size: int, checksum: str, downloaded_at: datetime = None):
+        """Records the file of a day, call save to persist the index
+
+        Args:
+            partition: The day ('%Y-%m-%d')
+            file: The file relative to the data directory
+            size: The size of the file in bytes
+            checksum: The sha256 hex digest of the file (see file_checksum)
+            downloaded_at: (optional) When the file was written (UTC), if none is specified now is used
+        """
+        self.partitions[partition] = {'file': str(file),
+                                      'size': size,
+                                      'checksum': checksum,
+                                      'downloaded_at': (downloaded_at or datetime.datetime.utcnow())
+                                      .strftime(_TIME_FORMAT)}
+
+    def save(self):
+        """Atomically replaces the index file"""
+        path = index_path(self.data_set)
+        path.parent.mkdir(exist_ok=True, parents=True)
+        with tempfile.NamedTemporaryFile('w', dir=str(path.parent), delete=False) as tmp_file:
+            json.dump(self.partitions, tmp_file, sort_keys=True, separators=(',', ':'))
+        os.replace(tmp_file.name, str(path))
+
+
+def index_path(data_set: str) -> Path:
+    """The path of the partition index of a data set"""
+    return Path(config.data_dir(), '.state', 'partition-index_{data_set}_{version}.json'.format(
+        data_set=data_set, version=config.output_file_version()))
+
+
+def load(data_set: str, read_only: bool = False) -> PartitionIndex:
+    """Reads the partition index of a data set, builds it from the files in the data directory when
+    there is no index yet
+
+    Args:
+        data_set: The name of the data set, e.g. 'ad-performance'
+        read_only: Whether to not save an index that was built, e.g. for dry runs
+    """
+    path = index_path(data_set)
+    if path.is_file():
+        with path.open() as index_file:
+            return PartitionIndex(data_set, json.load(index_file))
+
+    partition_index = _build(data_set)
+    if not read_only:
+        partition_index.save()
+    return partition_index
+
+
+def file_checksum(path: Path) -> str:
+    """The sha256 hex digest of a file"""
+    checksum = hashlib.sha256()
+    with open(str(path), 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def _build(data_set: str) -> PartitionIndex:
+    """Builds the partition index of a data set from the daily files in the configured output format
+    and the compacted months in the data directory"""
+    logging.info('building the partition index of {} from {}'.format(data_set, config.data_dir()))
+    data_dir = Path(config.data_dir())
+    partition_index = PartitionIndex(data_set)
+
+    for index_file in sorted(data_dir.glob('[0-9][0-9][0-9][0-9]/[0-9][0-9]/google-ads/{}_{}.index.json'.format(
+            data_set, config.output_file_version()))):
+        year, month = int(index_file.parent.parent.parent.name), int(index_file.parent.parent.name)
+        monthly_file = compaction.monthly_file_path(data_set, year, month)
+        if not Path(data_dir, monthly_file).is_file():
+            continue
+        stat = Path(data_dir, monthly_file).stat()
+        checksum = file_checksum(Path(data_dir, monthly_file))
+        for day in compaction.compacted_days(data_set, year, month):
+            partition_index.add(day, monthly_file, stat.st_size, checksum,
+                                datetime.datetime.utcfromtimestamp(stat.st_mtime))
+
+    for daily_file in sorted(data_dir.glob('[0-9][0-9][0-9][0-9]/[0-9][0-9]/[0-9][0-9]/google-ads/{}_{}{}'.format(
+            data_set, config.output_file_version(), output_formats.file_extension()))):
+        relative_filepath = daily_file.relative_to(data_dir)
+        stat = daily_file.stat()
+        partition_index.add('{}-{}-{}'.format(*relative_filepath.parts[:3]), relative_filepath, stat.st_size,
+                            file_checksum(daily_file), datetime.datetime.utcfromtimestamp(stat.st_mtime))
+    return partition_index
@@ -0,0 +1,203 @@
+"""
+Plans the performance reports of a run as work units in the order of their priority and estimates
+how many requests, rows and how much time a run takes from the metrics of a previous run
+"""
+import collections
+import datetime
+import math
+
+from google_ads_downloader import config
+
+# The reports of all client customers for consecutive days, from first_date to last_date
+WorkUnit = collections.namedtuple('WorkUnit', ['report_type', 'first_date', 'last_date', 'priority'])
+
+# The priorities of work units in the order in which they are downloaded: the days in the redownload window,
+# which change the most, and then the days for which there is no file yet
+PRIORITIES = ('redownload-window', 'missing')
+
+
+def plan_work_units(report_type: str, dates_by_priority: {str: [datetime]}) -> [WorkUnit]:
+    """Splits the days to download into work units of at most `config.max_days_per_report()` consecutive days,
+    ordered by priority and from newest to oldest within a priority. The work units are only split into
+    the reports of single client customers when they are downloaded.
+
+    Args:
+        report_type: The name of the report type, e.g. 'AD_PERFORMANCE_REPORT'
+        dates_by_priority: The days to download by priority (see PRIORITIES), ordered from newest to oldest
+
+    Returns:
+        A list of WorkUnit tuples
+    """
+    return [WorkUnit(report_type, dates_chunk[-1], dates_chunk[0], priority)
+            for priority in PRIORITIES
+            for dates_chunk in consecutive_date_chunks(dates_by_priority.get(priority, []),
+                                                       int(config.max_days_per_report()))]
+
+
+def date_chunks(work_units: [WorkUnit]) -> [[datetime]]:
+    """Returns the days of each work unit
+
+    Returns:
+        A list of lists of consecutive dates, ordered from newest to oldest
+    """
+    return [[work_unit.last_date - datetime.timedelta(days=days)
+             for days in range((work_unit.last_date - work_unit.first_date).days + 1)]
+            for work_unit in work_units]
+
+
+def consecutive_date_chunks(dates: [datetime], max_days: int) -> [[datetime]]:
+    """Splits a descending list of dates into chunks of consecutive days
+
+    Args:
+        dates: A list of dates, ordered from newest to oldest
+        max_days: The maximum number of days per chunk
+
+    Returns:
+        A list of lists of consecutive dates, ordered from newest to oldest
+    """
+    chunks = []
+    for single_date in dates:
+        if (chunks and len(chunks[-1]) < max_days
+                and (chunks[-1][-1] - single_date).days == 1):
+            chunks[-1].append(single_date)
+        else:
+            chunks.append([single_date])
+    return chunks
+
+
+def estimate(work_units: [WorkUnit], client_customer_ids: [int], previous_metrics: {}) -> {str: {}}:
+    """Estimates the cost of downloading work units from the metrics of a previous run
+
+    The number of rows per day of each client customer is taken from its 'performance_rows' and
+    'performance_days' counters, the duration of a request from the 'api_request_seconds' histograms.
+    Client customers without metrics are estimated with the average of the report type. Reports that
+    would exceed `config.max_rows_per_report()` rows count as several requests.
+
+    Args:
+        work_units: A list of WorkUnit tuples
+        client_customer_ids: The client customers for which the work units are downloaded
+        previous_metrics: The metrics summary of a previous run (see metrics.summary), empty when unknown
+
+    Returns:
+        The 'work_units', 'days', 'requests', 'rows' and 'request_seconds' by priority, rows and seconds are
+        None when the previous run has no metrics for the report type
+    """
+    counters = collections.defaultdict(float)
+    for counter in previous_metrics.get('counters', []):
+        if counter['name'] in ('performance_rows', 'performance_days'):
+            labels = counter['labels']
+            counters[(counter['name'], labels.get('report_type'), labels.get('client_customer_id'))] \
+                += counter['value']
+            counters[(counter['name'], labels.get('report_type'), None)] += counter['value']
+    request_seconds = collections.defaultdict(lambda: [0, 0.0])
+    for histogram in previous_metrics.get('histograms', []):
+        if histogram['name'] == 'api_request_seconds':
+            for key in (histogram['labels'].get('report_type'), None):
+                request_seconds[key][0] += histogram['count']
+                request_seconds[key][1] += histogram['sum']
+
+    def rows_per_day(report_type: str, client_customer_id: int) -> float:
+        for key in ((report_type, str(client_customer_id)), (report_type, None)):
+            if counters[('performance_days',) + key]:
+                return counters[('performance_rows',) + key] / counters[('performance_days',) + key]
+        return None
+
+    def seconds_per_request(report_type: str) -> float:
+        for key in (report_type, None):
+            if request_seconds[key][0]:
+                return request_seconds[key][1] / request_seconds[key][0]
+        return None
+
+    max_rows = int(config.max_rows_per_report())
+    estimates = {priority: {'work_units': 0, 'days': 0, 'requests': 0, 'rows': 0, 'request_seconds': 0.0}
+                 for priority in PRIORITIES}
+    # the rows per day of each client customer by report type
+    rows_per_day_by_report_type = {}
+    for work_unit in work_units:
+        days = (work_unit.last_date - work_unit.first_date).days + 1
+        unit_seconds_per_request = seconds_per_request(work_unit.report_type)
+        priority_estimate = estimates[work_unit.priority]
+        priority_estimate['work_units'] += 1
+        priority_estimate['days'] += days
+
+        if work_unit.report_type not in rows_per_day_by_report_type:
+            rows_per_day_by_report_type[work_unit.report_type] = [
+                rows_per_day(work_unit.report_type, client_customer_id) for client_customer_id in client_customer_ids]
+        for client_customer_rows_per_day in rows_per_day_by_report_type[work_unit.report_type]:
+            requests = (1 if client_customer_rows_per_day is None
+                        else max(1, math.ceil(client_customer_rows_per_day * days / max_rows)))
+            priority_estimate['requests'] += requests
+            if priority_estimate['rows'] is not None:
+                priority_estimate['rows'] = (None if client_customer_rows_per_day is None
+                                             else priority_estimate['rows'] + client_customer_rows_per_day * days)
+            if priority_estimate['request_seconds'] is not None:
+                priority_estimate['request_seconds'] = (None if unit_seconds_per_request is None
+                                                        else priority_estimate['request_seconds']
+                                                        + unit_seconds_per_request * requests)
+    return estimates
+
+
+def wall_clock_seconds(requests: int, request_seconds: float) -> float:
+    """Estimates how long requests take with `config.max_parallel_requests()` parallel requests and
+    at most `config.requests_per_second()` requests per second
+
+    Args:
+        requests: The number of requests
+        request_seconds: The total duration of the requests when made one after another, None when unknown
+
+    Returns:
+        The number of seconds, None when it is unknown
+    """
+    if request_seconds is None:
+        return None
+    seconds = request_seconds / max(1, int(config.max_parallel_requests()))
+    if float(config.requests_per_second()):
+        seconds = max(seconds, requests / float(config.requests_per_second()))
+    return seconds
+
+
+def format_estimates(estimates_by_report_type: {str: {str: {}}}, other_requests: int,
+                     remaining_operations: int = None) -> [str]:
+    """Formats the estimates of all report types (see estimate) as a table
+
+    Args:
+        estimates_by_report_type: The estimates by priority of each report type
+        other_requests: The number of requests that are made besides the performance reports,
+            e.g. for the account structure
+        remaining_operations: The remaining daily operation budget, None when there is no budget
+
+    Returns:
+        A list of lines
+    """
+    lines = ['{:<28} {:<18} {:>10} {:>8} {:>10} {:>14} {:>10}'.format(
+        'report type', 'priority', 'work units', 'days', 'requests', 'rows', 'time')]
+    total_requests, total_request_seconds = other_requests, 0.0
+    for report_type, estimates in estimates_by_report_type.items():
+        for priority in PRIORITIES:
+            priority_estimate = estimates[priority]
+            lines.append('{:<28} {:<18} {:>10} {:>8} {:>10} {:>14} {:>10}'.format(
+                report_type, priority, priority_estimate['work_units'], priority_estimate['days'],
+                priority_estimate['requests'], _format_number(priority_estimate['rows']),
+                _format_duration(wall_clock_seconds(priority_estimate['requests'],
+                                                    priority_estimate['request_seconds']))))
+            total_requests += priority_estimate['requests']
+            if total_request_seconds is not None and priority_estimate['request_seconds'] is not None:
+                total_request_seconds += priority_estimate['request_seconds']
+            else:
+                total_request_seconds = None
+    lines.append('{} requests in total ({} besides performance reports), estimated time {}'.format(
+        total_requests, other_requests, _format_duration(wall_clock_seconds(total_requests, total_request_seconds))))
+    if remaining_operations is not None and total_requests > remaining_operations:
+        lines.append('the remaining daily operation budget of {} requests is exceeded, the remaining '
+                     'work units are downloaded by the next runs'.format(remaining_operations))
+    return lines
+
+
+def _format_number(number: float) -> str:
+    return 'unknown' if number is None else '{:,.0f}'.format(number)
+
+
+def _format_duration(seconds: float) -> str:
+    if seconds is None:
+        return 'unknown'
+    return str(datetime.timedelta(seconds=round(seconds)))
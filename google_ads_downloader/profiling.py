@@ -0,0 +1,115 @@
+"""
+A sampling profiler and allocation snapshots for diagnosing slow or memory hungry runs
+"""
+import collections
+import datetime
+import logging
+import os
+import sys
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+# How many seconds to wait between two samples of the stacks of all threads
+_SAMPLING_INTERVAL = 0.005
+
+# How many lines with the largest allocation differences are written per snapshot
+_TOP_ALLOCATIONS = 25
+
+# Excludes the allocations of the profiler itself from snapshots
+_SNAPSHOT_FILTERS = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+
+# The directory of the profile of the current run, None when the run is not profiled
+_profile_directory = None
+_allocations_lock = threading.Lock()
+
+
+@contextmanager
+def profile_run(directory: Path):
+    """Samples the stacks of all threads while the block runs and writes them to `stacks.folded`
+    in the format of Brendan Gregg's flamegraph.pl (also readable by speedscope). Allocations are traced,
+    so that allocation_snapshot can write the largest allocations to `allocations.txt`.
+
+    Args:
+        directory: The directory in which the profile is written
+    """
+    global _profile_directory
+
+    directory.mkdir(exist_ok=True, parents=True)
+    _profile_directory = directory
+    tracemalloc.start()
+    sampler = _StackSampler(_SAMPLING_INTERVAL)
+    sampler.start()
+    try:
+        yield
+    finally:
+        sampler.stop()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        _profile_directory = None
+        with Path(directory, 'stacks.folded').open('w') as stacks_file:
+            for stack, count in sorted(sampler.stacks.items()):
+                stacks_file.write('{} {}\n'.format(stack, count))
+        logging.info('profile written to {} ({} samples, {:.1f} MB peak traced memory)'.format(
+            directory, sum(sampler.stacks.values()), peak / 1024 / 1024))
+
+
+@contextmanager
+def allocation_snapshot(name: str):
+    """Writes the largest differences in allocated memory between the start and the end of the block
+    to `allocations.txt` when the run is profiled (see profile_run), does nothing otherwise
+
+    Note that allocations of other threads during the block are included.
+
+    Args:
+        name: A description of the block, e.g. 'download_account_structure ads'
+    """
+    directory = _profile_directory
+    if directory is None or not tracemalloc.is_tracing():
+        yield
+        return
+
+    before = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+    try:
+        yield
+    finally:
+        if tracemalloc.is_tracing():
+            after = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+            current, peak = tracemalloc.get_traced_memory()
+            differences = after.compare_to(before, 'lineno')[:_TOP_ALLOCATIONS]
+            with _allocations_lock, Path(directory, 'allocations.txt').open('a') as allocations_file:
+                allocations_file.write('# {} at {:%Y-%m-%d %H:%M:%S}, {:.1f} MB traced, {:.1f} MB peak\n'.format(
+                    name, datetime.datetime.now(), current / 1024 / 1024, peak / 1024 / 1024))
+                for difference in differences:
+                    allocations_file.write('{}\n'.format(difference))
+                allocations_file.write('\n')
+
+
+class _StackSampler(threading.Thread):
+    """Periodically records the stacks of all other threads, counted by folded stack"""
+
+    def __init__(self, interval: float):
+        super().__init__(name='stack-sampler', daemon=True)
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename),
+                                                     code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
@@ -0,0 +1,133 @@
+"""
+A token bucket rate limiter with a daily operation budget that is shared by all calls to the Google Ads API
+"""
+import datetime
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from google_ads_downloader import config, sharding
+
+
+class DailyOperationBudgetExceededError(Exception):
+    """Raised when `config.daily_operation_budget()` operations were already made today"""
+    pass
+
+
+class RateLimiter:
+    """Throttles API calls to `config.requests_per_second()` and counts them against `config.daily_operation_budget()`
+
+    The number of operations of the current day is persisted in the data directory (except by dry runs),
+    so that the budget is shared by all runs of a day.
+    """
+
+    def __init__(self, requests_per_second: float, daily_operation_budget: int, state_path: Path):
+        """
+        Args:
+            requests_per_second: How many requests to make per second at max (0 for no limit)
+            daily_operation_budget: How many operations to make per day at max (0 for no limit)
+            state_path: The file in which the number of operations of the current day is stored
+        """
+        self.requests_per_second = requests_per_second
+        self.daily_operation_budget = daily_operation_budget
+        self.state_path = state_path
+        self._tokens = max(1.0, requests_per_second)
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self._day, self._operations = self._load_operations()
+
+    def acquire(self):
+        """Blocks until the next request can be made
+
+        Raises:
+            DailyOperationBudgetExceededError: When the daily operation budget is used up
+        """
+        with self._lock:
+            self._count_operation()
+
+            now = time.monotonic()
+            wait = max(0.0, self._paused_until - now)
+            if self.requests_per_second > 0:
+                self._tokens = min(max(1.0, self.requests_per_second),
+                                   self._tokens + (now - self._last_refill) * self.requests_per_second)
+                self._last_refill = now
+                # tokens can become negative, which reserves the time slot of the request
+                self._tokens -= 1
+                if self._tokens < 0:
+                    wait = max(wait, -self._tokens / self.requests_per_second)
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Delays all following requests, e.g. when the server asks to retry after a number of seconds"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def remaining_operations(self) -> int:
+        """How many operations are left for today, None when there is no daily budget"""
+        if not self.daily_operation_budget:
+            return None
+        with self._lock:
+            self._roll_over_day()
+            return max(0, self.daily_operation_budget - self._operations)
+
+    def _count_operation(self):
+        """Counts an operation against the daily budget and persists the count, except in dry runs"""
+        if not self.daily_operation_budget:
+            return
+        self._roll_over_day()
+        if self._operations >= self.daily_operation_budget:
+            raise DailyOperationBudgetExceededError(
+                'The daily budget of {} operations is used up'.format(self.daily_operation_budget))
+        self._operations += 1
+        if config.dry_run():
+            # a dry run does not write to the data directory
+            return
+        self.state_path.parent.mkdir(exist_ok=True, parents=True)
+        with tempfile.NamedTemporaryFile('w', dir=str(self.state_path.parent), delete=False) as tmp_file:
+            json.dump({'day': self._day, 'operations': self._operations}, tmp_file)
+        os.replace(tmp_file.name, str(self.state_path))
+
+    def _roll_over_day(self):
+        """Resets the operation count when a new day started"""
+        today = datetime.date.today().isoformat()
+        if self._day != today:
+            self._day, self._operations = today, 0
+
+    def _load_operations(self) -> (str, int):
+        """Reads the number of operations of the current day"""
+        today = datetime.date.today().isoformat()
+        try:
+            with self.state_path.open() as state_file:
+                state = json.load(state_file)
+        except (FileNotFoundError, ValueError):
+            return today, 0
+        if state.get('day') != today:
+            return today, 0
+        logging.info('{} API operations were already made today'.format(state['operations']))
+        return today, state['operations']
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def rate_limiter() -> RateLimiter:
+    """Returns the rate limiter that is shared by all API calls of the process"""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            # the shards of a run share the quota, each one gets an equal slice of the rate and the budget
+            shard_count = int(config.shard_count()) if sharding.is_sharded() else 1
+            daily_operation_budget = int(config.daily_operation_budget())
+            _rate_limiter = RateLimiter(requests_per_second=float(config.requests_per_second()) / shard_count,
+                                        daily_operation_budget=(max(1, daily_operation_budget // shard_count)
+                                                                if daily_operation_budget else 0),
+                                        state_path=Path(config.data_dir(), '.state', 'api-operations{}.json'
+                                                        .format(sharding.shard_suffix())))
+        return _rate_limiter
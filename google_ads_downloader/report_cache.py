@@ -0,0 +1,138 @@
+"""
+A content-addressed on-disk cache for downloaded reports in the data directory
+"""
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from google_ads_downloader import config
+
+# The total size of all cached reports in bytes, determined when the cache is first written to
+_cache_size = None
+_cache_lock = threading.Lock()
+
+
+def is_enabled() -> bool:
+    """Whether reports are cached"""
+    return int(config.report_cache_max_size()) > 0
+
+
+def cache_directory() -> Path:
+    """The directory in which cached reports are stored"""
+    return Path(config.data_dir(), '.report-cache')
+
+
+def report_key(client_customer_id: int, report_filter: {}) -> str:
+    """Computes the cache key of a report
+
+    Args:
+        client_customer_id: The client customer id for which the report is downloaded
+        report_filter: The report definition containing the report type, fields, predicates and date range
+
+    Returns:
+        A hex digest that identifies the report
+    """
+    return hashlib.sha256(json.dumps([str(client_customer_id), report_filter],
+                                     sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get(key: str, ttl: int = None, final_since: datetime.datetime = None) -> Path:
+    """Looks up a cached report
+
+    Args:
+        key: The cache key from report_key
+        ttl: (optional) The number of seconds after which the cached report expires, if none is specified
+            the report never expires
+        final_since: (optional) When the data of the report stopped changing, reports that were cached
+            since then never expire
+
+    Returns:
+        The path of the gzipped report or None if the report is not cached or expired
+    """
+    path = _report_path(key)
+    try:
+        cached_at = path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+    if final_since is not None and cached_at >= final_since.timestamp():
+        return path
+    if ttl is not None and time.time() - cached_at > ttl:
+        return None
+    return path
+
+
+def put(key: str, report) -> Path:
+    """Stores a report in the cache and evicts the oldest reports when the cache exceeds
+    `config.report_cache_max_size()`
+
+    Args:
+        key: The cache key from report_key
+        report: A binary file with the report, positioned at its start
+
+    Returns:
+        The path of the gzipped report
+    """
+    global _cache_size
+
+    path = _report_path(key)
+    path.parent.mkdir(exist_ok=True, parents=True)
+    with tempfile.NamedTemporaryFile(dir=str(path.parent), delete=False) as tmp_file:
+        with gzip.GzipFile(fileobj=tmp_file, mode='wb') as gzip_file:
+            shutil.copyfileobj(report, gzip_file)
+    size = os.path.getsize(tmp_file.name)
+    try:
+        # an existing report with the same key is replaced
+        previous_size = path.stat().st_size
+    except FileNotFoundError:
+        previous_size = 0
+    os.replace(tmp_file.name, str(path))
+
+    with _cache_lock:
+        if _cache_size is None:
+            _cache_size = sum(cached_report.stat().st_size for cached_report in _cached_reports())
+        else:
+            _cache_size += size - previous_size
+        if _cache_size > int(config.report_cache_max_size()) * 1024 * 1024:
+            _evict()
+    return path
+
+
+def _evict():
+    """Removes the oldest cached reports until the cache is at 90% of its maximum size"""
+    global _cache_size
+
+    max_size = int(config.report_cache_max_size()) * 1024 * 1024 * 0.9
+    cached_reports = []
+    for cached_report in _cached_reports():
+        try:
+            stat = cached_report.stat()
+        except FileNotFoundError:
+            continue
+        cached_reports.append((stat.st_mtime, stat.st_size, cached_report))
+
+    _cache_size = sum(size for _, size, _ in cached_reports)
+    for _, size, cached_report in sorted(cached_reports):
+        if _cache_size <= max_size:
+            break
+        try:
+            cached_report.unlink()
+        except FileNotFoundError:
+            pass
+        _cache_size -= size
+
+
+def _cached_reports():
+    """Returns an iterator over the paths of all cached reports"""
+    return cache_directory().glob('*/*.csv.gz')
+
+
+def _report_path(key: str) -> Path:
+    """The path of a cached report, reports are distributed over sub directories by their key prefix"""
+    return Path(cache_directory(), key[:2], key + '.csv.gz')
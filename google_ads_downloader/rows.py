@@ -0,0 +1,92 @@
+"""
+A compact representation of report rows: tuples of the values of a report with a header that is shared by all rows
+"""
+import csv
+import functools
+import json
+
+# The types of report columns, values are kept as the strings of the report and only converted when they are
+# written to files with typed columns (see output_formats.typed_value)
+COLUMN_TYPES = {
+    'Day': 'date',
+    'Ad ID': 'int',
+    'Keyword ID': 'int',
+    'Ad group ID': 'int',
+    'Campaign ID': 'int',
+    'Device': 'category',
+    'Network (with search partners)': 'category',
+    'Active View viewable impressions': 'int',
+    'Avg. position': 'float',
+    'Clicks': 'int',
+    'Conversions': 'float',
+    'Total conv. value': 'float',
+    'Cost': 'int',
+    'Impressions': 'int'
+}
+
+
+class ReportRow(tuple):
+    """A row of a report, values can be accessed by column name like in a dictionary
+
+    Subclasses for the columns of a report are created with row_class.
+    """
+    __slots__ = ()
+
+    # the column names of the report
+    columns = ()
+    # the position of each column in the row
+    _indexes = {}
+    # the json encoded column names, followed by the key separator
+    _json_keys = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return tuple.__getitem__(self, self._indexes[key])
+        return tuple.__getitem__(self, key)
+
+    def get(self, column: str, default=None):
+        """Returns the value of a column, default when the report has no such column"""
+        index = self._indexes.get(column)
+        return default if index is None else tuple.__getitem__(self, index)
+
+    def keys(self) -> (str,):
+        return self.columns
+
+    def to_json(self) -> str:
+        """Serializes the row as json object, the same as json.dumps of a dictionary of the row but without
+        creating one"""
+        return '{' + ', '.join(map(str.__add__, self._json_keys, map(json.dumps, self))) + '}'
+
+
+@functools.lru_cache(maxsize=None)
+def row_class(columns: (str,)) -> type:
+    """Creates the row class for the columns of a report, one class is shared by all reports with the same columns"""
+    return type('ReportRow', (ReportRow,), {'__slots__': (),
+                                            'columns': columns,
+                                            '_indexes': {column: index for index, column in enumerate(columns)},
+                                            '_json_keys': tuple(json.dumps(column) + ': ' for column in columns)})
+
+
+def parse_report(lines: iter) -> iter:
+    """Incrementally parses a csv report with a column header
+
+    Args:
+        lines: An iterator over the lines of the report
+
+    Returns:
+        An iterator over ReportRow objects with the string values of the report
+    """
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    row = row_class(tuple(header))
+    number_of_columns = len(header)
+    for values in reader:
+        if not values:
+            continue
+        if len(values) < number_of_columns:
+            # like csv.DictReader, missing values are None
+            values += [None] * (number_of_columns - len(values))
+        yield row(values)
+
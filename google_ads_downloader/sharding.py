@@ -0,0 +1,97 @@
+"""
+Partitions the client customers into shards, so that they can be downloaded by several processes or machines
+"""
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from google_ads_downloader import config
+
+
+def is_sharded() -> bool:
+    """Whether only a shard of the client customers is downloaded"""
+    return int(config.shard_count()) > 1
+
+
+def shard_of(client_customer_id: int, shard_count: int) -> int:
+    """The shard of a client customer, stable across runs, processes and machines"""
+    return int(hashlib.sha256(str(client_customer_id).encode()).hexdigest(), 16) % shard_count
+
+
+def select_client_customers(client_customers: {int: {}}) -> {int: {}}:
+    """Returns the client customers of the configured shard"""
+    shard_index, shard_count = int(config.shard_index()), int(config.shard_count())
+    if not 0 <= shard_index < shard_count:
+        raise ValueError('shard_index must be between 0 and {}, got {}'.format(shard_count - 1, shard_index))
+    return {client_customer_id: client_customer for client_customer_id, client_customer in client_customers.items()
+            if shard_of(client_customer_id, shard_count) == shard_index}
+
+
+def shard_directory(shard_index: int = None, shard_count: int = None) -> Path:
+    """The directory in which a shard keeps its partial files, by default the one of the configured shard"""
+    return Path(config.data_dir(), '.shards', 'shard-{}-of-{}'.format(
+        int(config.shard_index()) if shard_index is None else shard_index,
+        int(config.shard_count()) if shard_count is None else shard_count))
+
+
+def shard_suffix() -> str:
+    """A suffix for files that are written by each shard, empty when the run is not sharded"""
+    return '_shard-{}-of-{}'.format(config.shard_index(), config.shard_count()) if is_sharded() else ''
+
+
+def write_shard_state(last_date: datetime, complete: bool, partitions: [{}]):
+    """Records that the configured shard finished a run and which partitions it downloaded. The partitions
+    of previous runs that were not merged yet are kept.
+
+    Args:
+        last_date: The last day that was downloaded by the run
+        complete: Whether all data was downloaded, False when the daily operation budget was used up
+        partitions: The 'data_set', 'partition' (a day or None) and 'file' (the partial files relative to the
+            data directory) of each downloaded partition
+    """
+    path = Path(shard_directory(), 'shard.json')
+    path.parent.mkdir(exist_ok=True, parents=True)
+    previous_partitions = []
+    if path.is_file():
+        with path.open() as shard_file:
+            previous_partitions = json.load(shard_file)['partitions']
+    partitions = list({(partition['data_set'], partition['partition']): partition
+                       for partition in previous_partitions + partitions}.values())
+    with tempfile.NamedTemporaryFile('w', dir=str(path.parent), delete=False) as tmp_file:
+        json.dump({'shard_index': int(config.shard_index()),
+                   'shard_count': int(config.shard_count()),
+                   'last_date': last_date.strftime('%Y-%m-%d'),
+                   'complete': complete,
+                   'finished_at': datetime.datetime.now().isoformat(),
+                   'partitions': partitions}, tmp_file, indent=2)
+    os.replace(tmp_file.name, str(path))
+
+
+def load_shard_states(shard_count: int) -> [{}]:
+    """Reads the states of all shards (see write_shard_state)
+
+    Raises:
+        ValueError: When a shard did not finish or did not download all data
+
+    Returns:
+        A list with the state of each shard, ordered by shard index
+    """
+    shard_states = []
+    unfinished_shards = []
+    for shard_index in range(shard_count):
+        path = Path(shard_directory(shard_index, shard_count), 'shard.json')
+        if not path.is_file():
+            unfinished_shards.append(shard_index)
+            continue
+        with path.open() as shard_file:
+            shard_state = json.load(shard_file)
+        if not shard_state['complete']:
+            unfinished_shards.append(shard_index)
+        shard_states.append(shard_state)
+    if unfinished_shards:
+        raise ValueError('The shards {} of {} did not finish'.format(
+            ', '.join(map(str, unfinished_shards)), shard_count))
+    return shard_states
@@ -0,0 +1,97 @@
+"""
+Persists the OAuth2 access token and the client customers between runs, so that frequent runs start without
+refreshing the token and without listing all accounts of the manager account
+"""
+import datetime
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+from google_ads_downloader import config
+
+# The format of the times in the cache files (UTC)
+_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+# How many seconds before its expiry a cached access token is not used anymore
+_ACCESS_TOKEN_EXPIRY_MARGIN = 300
+
+
+def load_client_customers() -> {int: {}}:
+    """Returns the cached client customers of the manager account, or None when the cache is disabled,
+    empty or older than `config.client_customers_cache_ttl()` seconds"""
+    ttl = int(config.client_customers_cache_ttl())
+    cache = _load(_client_customers_cache_path()) if ttl else None
+    if cache is None:
+        return None
+    fetched_at = datetime.datetime.strptime(cache['fetched_at'], _TIME_FORMAT)
+    if (datetime.datetime.utcnow() - fetched_at).total_seconds() > ttl:
+        return None
+    logging.info('using {} cached client customers from {}'.format(len(cache['client_customers']),
+                                                                  cache['fetched_at']))
+    return {int(client_customer_id): client_customer
+            for client_customer_id, client_customer in cache['client_customers'].items()}
+
+
+def save_client_customers(client_customers: {int: {}}):
+    """Caches the client customers of the manager account when `config.client_customers_cache_ttl()` is set
+    (except for dry runs)"""
+    if int(config.client_customers_cache_ttl()) and not config.dry_run():
+        _save(_client_customers_cache_path(), {'fetched_at': datetime.datetime.utcnow().strftime(_TIME_FORMAT),
+                                               'client_customers': client_customers})
+
+
+def load_access_token() -> (str, datetime):
+    """Returns the cached OAuth2 access token and its expiry (UTC), or (None, None) when the cache is disabled,
+    empty or the token is about to expire"""
+    cache = _load(_access_token_cache_path()) if config.cache_oauth2_access_token() else None
+    if cache is None:
+        return None, None
+    token_expiry = datetime.datetime.strptime(cache['token_expiry'], _TIME_FORMAT)
+    if (token_expiry - datetime.datetime.utcnow()).total_seconds() < _ACCESS_TOKEN_EXPIRY_MARGIN:
+        return None, None
+    return cache['access_token'], token_expiry
+
+
+def save_access_token(access_token: str, token_expiry: datetime):
+    """Caches an OAuth2 access token when `config.cache_oauth2_access_token()` is enabled (except for dry runs)"""
+    if config.cache_oauth2_access_token() and access_token and token_expiry and not config.dry_run():
+        _save(_access_token_cache_path(), {'access_token': access_token,
+                                           'token_expiry': token_expiry.strftime(_TIME_FORMAT)})
+
+
+def _client_customers_cache_path() -> Path:
+    """The cache file of the client customers, specific to the manager account"""
+    return Path(config.data_dir(), '.state', 'client-customers_{}.json'.format(
+        _key(config.client_customer_id())))
+
+
+def _access_token_cache_path() -> Path:
+    """The cache file of the access token, specific to the OAuth2 client and refresh token"""
+    return Path(config.data_dir(), '.state', 'oauth2-access-token_{}.json'.format(
+        _key(config.oauth2_client_id(), config.oauth2_refresh_token())))
+
+
+def _key(*values: str) -> str:
+    """A short hash of the values, so that cache files do not contain credentials in their names"""
+    return hashlib.sha256('\n'.join(map(str, values)).encode()).hexdigest()[:16]
+
+
+def _load(path: Path) -> {}:
+    """Reads a cache file, returns None when it does not exist or is unreadable"""
+    try:
+        with path.open() as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _save(path: Path, content: {}):
+    """Atomically replaces a cache file, only readable by the current user"""
+    path.parent.mkdir(exist_ok=True, parents=True)
+    with tempfile.NamedTemporaryFile('w', dir=str(path.parent), delete=False) as tmp_file:
+        json.dump(content, tmp_file)
+    os.chmod(tmp_file.name, 0o600)
+    os.replace(tmp_file.name, str(path))
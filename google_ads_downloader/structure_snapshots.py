@@ -0,0 +1,152 @@
+"""
+Snapshots of the account structure of single client customers, so that only changed client customers are redownloaded
+"""
+import csv
+import datetime
+import gzip
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from google_ads_downloader import config, fingerprints
+
+# The format of the times in the snapshot state (UTC)
+_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+class AccountStructureSnapshots:
+    """Keeps the account structure rows of each client customer in a directory, together with a state
+    of when each snapshot was downloaded and when the client customer was last probed for changes
+
+    The rows of a snapshot are tab separated without a header, in the format of the account structure file.
+    The first two columns (ad or keyword id and ad group id) identify a row.
+    """
+
+    def __init__(self, directory: Path, state_name: str, track_changes: bool = False):
+        """
+        Args:
+            directory: The directory in which the snapshots are stored
+            state_name: The name under which the state is stored (see fingerprints.load)
+            track_changes: Whether to compare replaced snapshots with their previous version (see changes)
+        """
+        self.directory = directory
+        self.state_name = state_name
+        self.track_changes = track_changes
+        self.state = fingerprints.load(state_name)
+        # the rows that were added, changed or removed by the current run as (change, row) tuples
+        self.changes = []
+        self._lock = threading.Lock()
+
+    def is_current(self, client_customer_id: int, attributes_fingerprint: str, now: datetime) -> bool:
+        """Whether the snapshot of a client customer can be reused when the change probe finds no changes
+
+        Args:
+            client_customer_id: A client customer id
+            attributes_fingerprint: The fingerprint of the client customer, campaign and ad group attributes
+            now: The current time (UTC)
+        """
+        entry = self.state.get(str(client_customer_id))
+        return bool(entry
+                    and entry['attributes_fingerprint'] == attributes_fingerprint
+                    and (now - _parse_time(entry['downloaded_at'])).days
+                    < int(config.account_structure_snapshot_max_age())
+                    and self._snapshot_path(client_customer_id).is_file())
+
+    def probed_at(self, client_customer_id: int) -> datetime:
+        """When the client customer was last probed for changes (or its snapshot downloaded), in UTC"""
+        return _parse_time(self.state[str(client_customer_id)]['probed_at'])
+
+    def record_probe(self, client_customer_id: int, probed_at: datetime):
+        """Records that no changes were found when probing a client customer"""
+        with self._lock:
+            self.state[str(client_customer_id)]['probed_at'] = probed_at.strftime(_TIME_FORMAT)
+
+    @contextmanager
+    def replace(self, client_customer_id: int, attributes_fingerprint: str, downloaded_at: datetime):
+        """Replaces the snapshot of a client customer with the rows that are written to the yielded csv writer
+        and records the changed rows when changes are tracked
+
+        Args:
+            client_customer_id: A client customer id
+            attributes_fingerprint: The fingerprint of the client customer, campaign and ad group attributes
+            downloaded_at: When the change probe (or the download) started, in UTC
+        """
+        path = self._snapshot_path(client_customer_id)
+        path.parent.mkdir(exist_ok=True, parents=True)
+        with gzip.open(str(path) + '.tmp', 'wt', compresslevel=1) as snapshot_file:
+            yield csv.writer(snapshot_file, delimiter="\t")
+
+        changes = []
+        if self.track_changes:
+            changes = list(account_structure_changes(self.rows(client_customer_id),
+                                                     _read_rows(Path(str(path) + '.tmp'))))
+        os.replace(str(path) + '.tmp', str(path))
+        with self._lock:
+            self.changes += changes
+            self.state[str(client_customer_id)] = {'attributes_fingerprint': attributes_fingerprint,
+                                                   'downloaded_at': downloaded_at.strftime(_TIME_FORMAT),
+                                                   'probed_at': downloaded_at.strftime(_TIME_FORMAT)}
+
+    def rows(self, client_customer_id: int) -> iter:
+        """Returns an iterator over the rows of the snapshot of a client customer (empty if there is none)"""
+        path = self._snapshot_path(client_customer_id)
+        if str(client_customer_id) in self.state and path.is_file():
+            yield from _read_rows(path)
+
+    def copy_to(self, client_customer_id: int, file):
+        """Appends the rows of the snapshot of a client customer to an account structure file"""
+        with gzip.open(str(self._snapshot_path(client_customer_id)), 'rt', newline='') as snapshot_file:
+            shutil.copyfileobj(snapshot_file, file)
+
+    def remove_other_than(self, client_customer_ids: [int]):
+        """Removes the snapshots of client customers that do not exist anymore and records their rows as removed"""
+        client_customer_ids = set(map(str, client_customer_ids))
+        for client_customer_id in list(self.state.keys()):
+            if client_customer_id not in client_customer_ids:
+                if self.track_changes:
+                    self.changes += [('removed', row) for row in self.rows(int(client_customer_id))]
+                if self._snapshot_path(int(client_customer_id)).is_file():
+                    self._snapshot_path(int(client_customer_id)).unlink()
+                del self.state[client_customer_id]
+
+    def save(self):
+        """Persists the state of the snapshots"""
+        with self._lock:
+            fingerprints.save(self.state_name, self.state)
+
+    def _snapshot_path(self, client_customer_id: int) -> Path:
+        """The path of the snapshot of a client customer"""
+        return Path(self.directory, '{}.csv.gz'.format(client_customer_id))
+
+
+def account_structure_changes(previous_rows: iter, rows: iter) -> iter:
+    """Compares two versions of the account structure rows of a client customer
+
+    Args:
+        previous_rows: An iterator over the previous rows
+        rows: An iterator over the new rows
+
+    Returns:
+        An iterator over ('added' | 'changed' | 'removed', row) tuples
+    """
+    previous_rows_by_key = {tuple(row[:2]): row for row in previous_rows}
+    for row in rows:
+        previous_row = previous_rows_by_key.pop(tuple(row[:2]), None)
+        if previous_row is None:
+            yield 'added', row
+        elif previous_row != row:
+            yield 'changed', row
+    for previous_row in previous_rows_by_key.values():
+        yield 'removed', previous_row
+
+
+def _read_rows(path: Path) -> iter:
+    """Reads the rows of a snapshot file"""
+    with gzip.open(str(path), 'rt', newline='') as snapshot_file:
+        yield from csv.reader(snapshot_file, delimiter="\t")
+
+
+def _parse_time(value: str) -> datetime:
+    return datetime.datetime.strptime(value, _TIME_FORMAT)
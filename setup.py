@@ -11,6 +11,11 @@ setup(
         'wheel>=0.29'
     ],
 
+    extras_require={
+        'parquet': ['pyarrow'],
+        'zstd': ['zstandard']
+    },
+
     packages=find_packages(),
 
     author='Mara contributors',
@@ -19,7 +24,10 @@ setup(
     entry_points={
         'console_scripts': [
             'download-google-ads-performance-data=google_ads_downloader.cli:download_data',
-            'refresh-google-ads-api-oauth2-token=google_ads_downloader.cli:refresh_oauth2_token'
+            'download-google-ads-performance-data-continuously=google_ads_downloader.cli:download_data_continuously',
+            'refresh-google-ads-api-oauth2-token=google_ads_downloader.cli:refresh_oauth2_token',
+            'compact-google-ads-performance-data=google_ads_downloader.cli:compact_data',
+            'merge-google-ads-shards=google_ads_downloader.cli:merge_shards'
         ]
     }
 )